@@ -1,4 +1,5 @@
 import sys
+import numpy as np
 import matplotlib.colors
 import matplotlib.cm as cm
 
@@ -217,6 +218,9 @@ class ColorMap(object):
        Note that all colormaps in here are normalized on [0.0, 1.0].
     """
 
+    # RGBA lookup tables of the base colormaps, shared by all ColorMaps
+    lookup_tables = dict()
+
     def __init__(self, base_color_map = 'copper',
         color_step = 0, step_size = 0.1):
         """Create a ColorMap object.
@@ -291,6 +295,66 @@ class ColorMap(object):
             stepped_value = round(value / self.step_size) % self.color_step
             return self.color_map(1.0 / self.color_step * stepped_value)
 
+    def lookupTable(self):
+        """Returns the lookup table of the base colormap as a float32 array
+           of RGBA rows: its under color, its N colors, its over color and
+           its bad color. The table is built once per colormap.
+        """
+        if self.color_map_name not in ColorMap.lookup_tables:
+            N = self.color_map.N
+            table = np.empty((N + 3, 4), dtype = np.float32)
+            table[:N + 2] = self.color_map(np.arange(-1, N + 1))
+            table[N + 2] = self.color_map(np.array([np.nan]))[0]
+            ColorMap.lookup_tables[self.color_map_name] = table
+        return ColorMap.lookup_tables[self.color_map_name]
+
+    def getColors(self, values, preempt_range = 0, bounds = None,
+        out_of_range_color = None, out_of_range_alpha = None):
+        """Gets the colors associated with an array of values as an array
+           of float32 RGBA rows, matching getColor for each value.
+
+           preempt_range
+               As in getColor.
+
+           bounds
+               Optional (lower, upper) pair. Colors of values outside of
+               it are replaced with out_of_range_color if given, otherwise
+               their alpha is set to out_of_range_alpha if given.
+        """
+        values = np.asarray(values, dtype = np.float64)
+
+        if self.color_step == 0:
+            scaled = values
+        else:
+            if preempt_range != 0:
+                steps = values * preempt_range
+            else:
+                steps = values / self.step_size
+            # Round halves away from zero like round does
+            steps = np.sign(steps) * np.floor(np.abs(steps) + 0.5)
+            scaled = 1.0 / self.color_step * np.mod(steps, self.color_step)
+
+        # Index the table the way the matplotlib colormap would
+        table = self.lookupTable()
+        N = len(table) - 3
+        scaled = scaled * N
+        bad = np.isnan(scaled)
+        scaled[bad] = 0
+        scaled[scaled == N] = N - 1
+        index = np.clip(scaled, 0, N).astype(np.intp) + 1
+        index[scaled < 0] = 0
+        index[bad] = N + 2
+        colors = table[index]
+
+        if bounds is not None:
+            outside = (values < bounds[0] - 1e-8) | (values > bounds[1] + 1e-8)
+            if out_of_range_color is not None:
+                colors[outside] = out_of_range_color
+            elif out_of_range_alpha is not None:
+                colors[outside, 3] = out_of_range_alpha
+
+        return colors
+
 class ColorBarImage(QImage):
     """QImage representing the color bar, will incorporate cycling"""
 
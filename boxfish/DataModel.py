@@ -5,6 +5,9 @@ import os.path
 from Table import *
 from SubDomain import *
 from Projection import *
+from Filter import FilterChainCache
+from boxfish.util.IdMap import IdMap
+from boxfish.util.LRUCache import LRUCache
 import YamlLoader as yl
 import functools
 
@@ -102,6 +105,9 @@ class RunItem(AbstractTreeItem):
         self.subdomains = None
         self._table_subdomains = None
         self._projection_subdomains = None
+        self.id_maps = dict()
+        self._table_index = dict()
+        self._attribute_index = dict()
 
     def typeInfo(self):
         """Returns RUN"""
@@ -183,9 +189,92 @@ class RunItem(AbstractTreeItem):
             self.subdomain_matrix[i][j] = projection
             self.subdomain_matrix[j][i] = projection
 
+        # Table lookup by name
+        self._table_index = dict()
+        for table in tables._children:
+            if table.name not in self._table_index:
+                self._table_index[table.name] = table
+
+        # Attribute lookup: attribute -> subdomain -> tables having that
+        # attribute, ordered as preferred by findAttribute
+        self._attribute_index = dict()
+        for subdomain in self._table_subdomains:
+            distances = [self.tableDistance(subdomain, table)
+                for table in tables._children]
+            for distance, table in sorted(zip(distances, tables._children),
+                key = lambda pair: pair[0]):
+                for attribute in table.attributeNames():
+                    self._attribute_index.setdefault(attribute,
+                        dict()).setdefault(subdomain, list()).append(table)
+
+
+    def tableDistance(self, subdomain, table):
+        """Returns 0 if the given table is of the given subdomain, 1 if
+           it is one projection away and 2 otherwise.
+        """
+        table_subdomain = table._table.subdomain()
+        if table_subdomain == subdomain:
+            return 0
+
+        if subdomain in self._projection_subdomains \
+            and table_subdomain in self._projection_subdomains:
+            index = self._projection_subdomains.index(subdomain)
+            t_index = self._projection_subdomains.index(table_subdomain)
+            if self.subdomain_matrix[index][t_index] is not None:
+                return 1
+
+        return 2
+
+
+    def buildIdMaps(self):
+        """Builds an IdMap for every subdomain of the Run from the IDs
+           found in its tables and projections. Like refreshSubdomains,
+           this is intended to be called by the DataTree once the tables
+           and projections of the Run have been added.
+        """
+        for child in self._children:
+            if child.name == "tables":
+                tables = child
+            else:
+                projections = child
+
+        subdomain_ids = dict((subdomain, list())
+            for subdomain in self.subdomains)
+        for table in tables._children:
+            subdomain_ids[table._table.subdomain()].append(
+                table._table._data[table._table._key])
+
+        for projection in projections._children:
+            ids = projection._projection.source_ids()
+            if ids is not None:
+                subdomain_ids[projection._projection.source].append(
+                    np.asarray(ids))
+            ids = projection._projection.destination_ids()
+            if ids is not None:
+                subdomain_ids[projection._projection.destination].append(
+                    np.asarray(ids))
+
+        self.id_maps = dict()
+        for subdomain, id_arrays in subdomain_ids.iteritems():
+            if id_arrays:
+                self.id_maps[subdomain] = IdMap(np.concatenate(id_arrays))
+            else:
+                self.id_maps[subdomain] = IdMap([])
+
+
+    def getIdMap(self, subdomain):
+        """Returns the IdMap of the given subdomain or None if the
+           subdomain is not part of this Run.
+        """
+        return self.id_maps.get(subdomain)
+
 
     def getTable(self, table_name):
         """Look up a child table by name."""
+        if table_name in self._table_index:
+            return self._table_index[table_name]
+
+        # Tables added since the last refreshSubdomains
         for child in self._children:
             if child.name == "tables":
                 tables = child
@@ -203,37 +292,20 @@ class RunItem(AbstractTreeItem):
            then to tables that are one projection away, then to all
            remaining tables.
         """
+        subdomain_tables = self._attribute_index.get(attribute)
+        if subdomain_tables is None:
+            return None
 
-        for child in self._children:
-            if child.name == "tables":
-                tables = child
-
-        # Subdomain is same
-        for t in tables._children:
-            if t._table.subdomain() == table._table.subdomain() \
-                and t.hasAttribute(attribute):
-                return t
-
-        # Make sure we can project the given table
-        if table._table.subdomain() in self._projection_subdomains:
-            index = self._projection_subdomains.index(table._table.subdomain())
-
-            # Subdomain is one hop
-            for t in tables._children:
-                if t._table.subdomain() in self._projection_subdomains:
-                    t_index = self._projection_subdomains.index(
-                        t._table.subdomain())
-                    if self.subdomain_matrix[index][t_index] is not None \
-                        and t.hasAttribute(attribute):
-                        return t
-
-
-        # Subdomain is more than one hop (may be infinite)
-        for t in tables._children:
-            if t.hasAttribute(attribute):
-                return t
+        subdomain = table._table.subdomain()
+        if subdomain in subdomain_tables:
+            return subdomain_tables[subdomain][0]
 
-        return None
+        # Table is not indexed by subdomain, rank the candidates directly
+        candidates = set()
+        for tables in subdomain_tables.values():
+            candidates.update(tables)
+        return min(candidates,
+            key = lambda t: (self.tableDistance(subdomain, t), t.row()))
 
 
     # This can find a projection within a Run. We still need
@@ -426,6 +498,10 @@ class TableItem(DataObjectItem):
        table are the children.
     """
 
+    # Columns with more distinct values than this are only summarized by
+    # their smallest and largest value in the attribute value catalog
+    value_catalog_limit = 1000
+
     def __init__(self, name, table, metadata, parent = None):
         """Construct a TableItem. The table is a Table object. The
            metadata is a dict.
@@ -433,19 +509,45 @@ class TableItem(DataObjectItem):
         super(TableItem, self).__init__(name, metadata, parent)
 
         self._table = table
+        self._attribute_names = set()
+        self._value_catalog = dict()
+        self._key_positions = None # (IdMap, positions) for subsetByKeys
 
     def typeInfo(self):
         """Return TABLE."""
         return "TABLE"
 
+    def addChild(self, child):
+        """Add an AttributeItem to this item, indexing its name."""
+        super(TableItem, self).addChild(child)
+        self._attribute_names.add(child.name)
+
+    def insertChild(self, position, child):
+        """Add an AttributeItem to this item at the given position,
+           indexing its name.
+        """
+        if super(TableItem, self).insertChild(position, child):
+            self._attribute_names.add(child.name)
+            return True
+        return False
+
+    def removeChild(self, position):
+        """Remove the AttributeItem at the given position."""
+        if super(TableItem, self).removeChild(position):
+            self._attribute_names = set(child.name
+                for child in self._children)
+            return True
+        return False
+
+    def attributeNames(self):
+        """Returns the set of names of this item's AttributeItems."""
+        return self._attribute_names
+
     def hasAttribute(self, attribute):
         """Returns True if this item has an AttributeItem with the given
            name.
         """
-        for child in self._children:
-            if child.name == attribute:
-                return True
-        return False
+        return attribute in self._attribute_names
 
     def buildAttributeValues(self, attribute, values = set()):
         """If the contained Table contains an attribute of the given name,
@@ -453,14 +555,25 @@ class TableItem(DataObjectItem):
            empty set otherwise.
         """
         if self.hasAttribute(attribute):
-            attributes = [attribute]
-            attribute_list = self._table.attributes_by_identifiers(
-                self._table.identifiers(), attributes)
-            for value in attribute_list[0]:
-                values.add(str(value))
+            values.update(self.attributeValues(attribute))
 
         return values
 
+    def attributeValues(self, attribute):
+        """Returns a frozenset of the distinct values of the given attribute
+           as strings. The set is computed on first use and cached. If the
+           attribute has more than value_catalog_limit distinct values,
+           only its smallest and largest values are returned.
+        """
+        if attribute not in self._value_catalog:
+            distinct = np.unique(self._table._data[attribute])
+            if len(distinct) > self.value_catalog_limit:
+                distinct = [distinct[0], distinct[-1]]
+            self._value_catalog[attribute] \
+                = frozenset(str(value) for value in distinct)
+
+        return self._value_catalog[attribute]
+
 
     # Query evaluation - maybe this should be put back into the
     # QueryEngine class that was at some point jettisoned.
@@ -512,10 +625,8 @@ class TableItem(DataObjectItem):
             keys = list(keys[0])
             projected_keys = projection.project(keys, self._table.subdomain())
 
-            identifiers_lists.append(self._table.subset_by_key(
-                self._table.identifiers(),
-                SubDomain.instantiate(self._table.subdomain(),
-                    projected_keys)))
+            identifiers_lists.append(self.subsetByKeys(
+                self._table.identifiers(), projected_keys))
 
         # Question: Does not applying the original tables identifiers
         # to everything else via projection cause a problem?
@@ -527,6 +638,34 @@ class TableItem(DataObjectItem):
         return self._table.subset_by_conditions(evaluated_identifiers,
             conditions)
 
+    def subsetByKeys(self, identifiers, keys):
+        """Returns the identifiers whose rows have one of the given keys.
+           Rows are matched by their position in the run's IdMap for the
+           table's subdomain.
+        """
+        identifiers = np.asarray(identifiers, dtype = np.int64)
+        if len(identifiers) == 0 or len(keys) == 0:
+            return []
+        key_column = self._table._data[self._table._key]
+        id_map = self.getRun().getIdMap(self._table.subdomain())
+        if id_map is not None and (self._key_positions is None
+            or self._key_positions[0] is not id_map):
+            positions = id_map.positions(key_column)
+            if np.all(positions >= 0):
+                self._key_positions = (id_map, positions)
+            else:
+                self._key_positions = None
+        if self._key_positions is None or self._key_positions[0] is not id_map:
+            # The run has no map holding all of this table's keys
+            return identifiers[np.in1d(key_column[identifiers],
+                keys)].tolist()
+
+        selected = np.zeros(len(id_map) + 1, dtype = bool)
+        selected[id_map.positions(keys)] = True
+        selected[-1] = False # position -1 marks keys not in the run
+        key_positions = self._key_positions[1]
+        return identifiers[selected[key_positions[identifiers]]].tolist()
+
     def createIdAttributeMaps(self, attributes, aggregator = 'max'):
         """Creates a forward and backward dict from the table's ID to
            a set of attributes, row-aggregated by the given aggreagor.
@@ -579,10 +718,28 @@ class DataTree(QAbstractItemModel):
        level 3 and Attributes at level 4.
     """
 
+    # Bounds of the cache of results evaluated ahead of time
+    frame_cache_entries = 256
+    frame_cache_bytes = 256 * 1024 * 1024
+
+    # Bounds of the cache of filtered identifiers
+    filter_cache_entries = 256
+    filter_cache_bytes = 256 * 1024 * 1024
+
     def __init__(self, root = AbstractTreeItem("BoxFish")):
         """Construct the DataTree for Boxfish."""
         super(DataTree, self).__init__(None)
         self._rootItem = root
+        self._attribute_values = dict()
+
+        # Filtered identifiers shared by all requests on this tree
+        self.filter_cache = FilterChainCache(self.filter_cache_entries,
+            self.filter_cache_bytes)
+
+        # Request results evaluated ahead of time, e.g. for the next
+        # steps of an animation
+        self.frame_cache = LRUCache(self.frame_cache_entries,
+            self.frame_cache_bytes)
 
 
     def rowCount(self, parent):
@@ -706,8 +863,13 @@ class DataTree(QAbstractItemModel):
     def getAttributeValues(self, attribute):
         """Returns a sorted list of all known values of the given
            attribute across all runs and tables in which it appears.
+           Attributes with many distinct values in a table are only
+           represented by their range in that table.
         """
-        return sorted(self._rootItem.buildAttributeValues(attribute, set()))
+        if attribute not in self._attribute_values:
+            self._attribute_values[attribute] = sorted(
+                self._rootItem.buildAttributeValues(attribute, set()))
+        return self._attribute_values[attribute][:]
 
 
     def insertProjection(self, name, projection, metadata, position=-1, \
@@ -744,6 +906,7 @@ class DataTree(QAbstractItemModel):
         self.beginInsertRows(parent, position, position + rows - 1)
         tableItem = TableItem(name, table, metadata, parentItem)
         self.endInsertRows()
+        self._attribute_values.clear()
 
         #Create attributes
         self.beginInsertRows(self.createIndex(position, 0, tableItem), 0, \
@@ -837,7 +1000,7 @@ class DataTree(QAbstractItemModel):
                     atable.fromRecArray(mydomains[0], mykeys[0], data)
                     aprojection = TableProjection(mydomains[0], mydomains[1],
                         source_key = mykeys[0], destination_key = mykeys[1],
-                        table = atable)
+                        table = atable, run = runItem)
                     self.insertProjection(mydomains[0].typename() + "<->"
                         + mydomains[1].typename(), aprojection, combined_meta,
                         parent = self.createIndex(position, 0, projectionsItem))
@@ -851,6 +1014,7 @@ class DataTree(QAbstractItemModel):
 
         runItem.refreshSubdomains()
         self.createSubDomainTables(runItem, projectionsItem, tablesItem)
+        runItem.buildIdMaps()
         return True
 
     def createSubDomainTables(self, run, projections, tables):
@@ -879,8 +1043,8 @@ class DataTree(QAbstractItemModel):
             table_meta['type'] = greater_subdomain.typename()
             table_meta['flags'] = 0
             table_meta['field'] = table_meta['type'] + "_id"
-            # Find a list of IDs for this subdomain from those projections
-            id_list = list()
+            # Find the IDs for this subdomain from those projections
+            id_arrays = list()
             for projection in projection_list:
 
                 if subdomain == projection.source:
@@ -895,13 +1059,15 @@ class DataTree(QAbstractItemModel):
                         table_meta['field'] = projection._destination_key
 
                 if ids is not None:
-                    id_list.extend(ids)
+                    id_arrays.append(np.asarray(ids))
 
-            id_list = list(set(id_list))
+            if id_arrays:
+                id_array = np.unique(np.concatenate(id_arrays))
+            else:
+                id_array = np.zeros(0, dtype = np.int64)
 
             # Create Table
-            data = np.rec.fromrecords([(x,) for x in id_list])
-            data.dtype.names = (table_meta['field'],)
+            data = np.rec.fromarrays([id_array], names = table_meta['field'])
             atable = Table()
             atable.fromRecArray(greater_subdomain, table_meta['field'], data)
 
@@ -912,6 +1078,10 @@ class DataTree(QAbstractItemModel):
             # Update subdomain list
             run._table_subdomains.append(subdomain)
 
+        if uncovered_subdomains:
+            # Index the tables we just created
+            run.refreshSubdomains()
+
 
     # TODO: Add the ability to remove elements
     def removeTable(self, position, rows, parent=QModelIndex()):
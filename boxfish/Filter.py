@@ -1,7 +1,10 @@
 from PySide.QtCore import *
 from PySide.QtGui import *
+import numpy as np
+import threading
 from FilterCoupler import *
 from Query import *
+from boxfish.util.LRUCache import LRUCache
 
 class Filter(QObject):
     """This class represents a filter on a data stream/query."""
@@ -34,3 +37,132 @@ class SimpleWhereFilter(Filter):
            identifiers.
         """
         return table.evaluate(self.conditions, identifiers)
+
+
+class FieldPartition(object):
+    """Partitions the rows of tables by the values of a single field. The
+       rows of a table are stably sorted by the field once, after which
+       the rows having any one value are a contiguous slice of that order.
+       Partitions may be requested from several threads.
+    """
+
+    def __init__(self, field):
+        """Construct a FieldPartition over the named field."""
+        super(FieldPartition, self).__init__()
+
+        self.field = field
+        self.partitions = dict()
+        self._lock = threading.Lock()
+
+    def partition(self, table):
+        """Returns the partition of the given TableItem as three arrays:
+           the sorted distinct values of the field, the offsets of the
+           rows of each value in the sorted order (with the number of
+           rows appended) and the sorted order of the rows.
+        """
+        with self._lock:
+            if table not in self.partitions:
+                column = np.asarray(table._table._data[self.field])
+                order = np.argsort(column, kind = 'mergesort')
+                values, starts = np.unique(column[order],
+                    return_index = True)
+                offsets = np.append(starts, len(order))
+                self.partitions[table] = (values, offsets, order)
+            return self.partitions[table]
+
+    def rows(self, table, value):
+        """Returns an ascending array of the rows of the given TableItem
+           where the field equals value.
+        """
+        values, offsets, order = self.partition(table)
+        position = np.searchsorted(values, value)
+        if position >= len(values) or values[position] != value:
+            return order[:0]
+        return order[offsets[position]:offsets[position + 1]]
+
+
+class PartitionFilter(SimpleWhereFilter):
+    """A filter selecting the rows where a field equals a value by
+       slicing a FieldPartition instead of scanning the table. Tables
+       without the field are filtered through the equivalent Clause.
+    """
+
+    def __init__(self, partition, value):
+        """Construct a PartitionFilter for the rows of the given
+           FieldPartition with the given value.
+        """
+        super(PartitionFilter, self).__init__(Clause('=',
+            TableAttribute(partition.field), value))
+
+        self.partition = partition
+        self.value = value
+
+    def process(self, table, identifiers):
+        """Given a TableItem from the DataTree and a list of identifiers
+           to consider from that TableItem's table, returns the identifiers
+           of the rows with the partition value.
+        """
+        if not table.hasAttribute(self.partition.field):
+            return super(PartitionFilter, self).process(table, identifiers)
+        if len(identifiers) == 0:
+            return list()
+
+        rows = self.partition.rows(table, self.value)
+        num_rows = len(table._table._data)
+        if len(identifiers) != num_rows: # Not every row is considered
+            considered = np.zeros(num_rows, dtype = bool)
+            considered[np.asarray(identifiers, dtype = np.int64)] = True
+            rows = rows[considered[rows]]
+        return rows.tolist()
+
+
+class FilterChainCache(object):
+    """Caches the identifiers of a table that pass an ordered chain of
+       filters, so that requests sharing a chain, or the start of one,
+       do not evaluate the same filters again. The identifiers after each
+       stage of a chain are kept, so changing the k-th filter of a chain
+       re-evaluates only filters k and later. Filters are keyed by
+       identity; a changed filter is a new Filter object. The identifiers
+       are kept as arrays of row numbers.
+    """
+
+    def __init__(self, max_entries = 256, max_bytes = None):
+        """Construct an empty cache holding at most max_entries filtered
+           identifier arrays and, unless max_bytes is None, at most
+           max_bytes bytes of them.
+        """
+        super(FilterChainCache, self).__init__()
+
+        self.cache = LRUCache(max_entries, max_bytes)
+
+    def identifiers(self, table, chain):
+        """Returns the identifiers of the given TableItem which pass every
+           filter in chain. Evaluation starts from the longest prefix of
+           the chain that is cached for the table.
+        """
+        chain = tuple(chain)
+
+        # Find the longest cached prefix
+        identifiers = None
+        start = len(chain)
+        while start > 0:
+            identifiers = self.cache.get((table, chain[:start]))
+            if identifiers is not None:
+                break
+            start -= 1
+        if identifiers is None:
+            identifiers = np.asarray(table._table.identifiers(),
+                dtype = np.int64)
+
+        # Apply the remaining filters, keeping the result of every stage
+        # so that a change to a later filter only re-evaluates from there
+        for stage in range(start, len(chain)):
+            identifiers = np.asarray(chain[stage].process(table,
+                identifiers.tolist()), dtype = np.int64)
+            self.cache.put((table, chain[:stage + 1]), identifiers)
+
+        return identifiers.tolist()
+
+    def clear(self):
+        """Discard all cached identifiers."""
+        self.cache.clear()
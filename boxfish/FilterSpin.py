@@ -1,6 +1,6 @@
-from PySide.QtCore import Qt, Signal, Slot
+from PySide.QtCore import Qt, Signal, Slot, QTimer, QThread
 from PySide.QtGui import QWidget, QHBoxLayout, QLabel, QSpinBox,\
-    QSpacerItem
+    QSpacerItem, QPushButton
 from ModuleFrame import *
 from ModuleAgent import *
 from GUIUtils import *
@@ -24,6 +24,10 @@ class FilterSpinAgent(ModuleAgent):
 
     spinUpdateSignal = Signal(str, list) # field name, values
 
+    # Number of spin steps after the selected one evaluated ahead of time
+    # during playback
+    prefetch_steps = 4
+
     def __init__(self, parent, datatree):
         """Constructor for FilterBoxAgent."""
         super(FilterSpinAgent, self).__init__(parent, datatree)
@@ -34,6 +38,16 @@ class FilterSpinAgent(ModuleAgent):
         self.spin_field = ""
         self.spin_selected = -1
 
+        # Rows of the spun tables partitioned by the spin field and the
+        # filter for each spin value, reused whenever a value is revisited
+        self.spin_partition = None
+        self.spin_filters = dict()
+
+        # While playing, downstream requests are evaluated ahead for the
+        # next steps
+        self.playing = False
+        self._prefetch_workers = set()
+
 
     def addDataIndices(self, indexList):
         """This function handles an added list of DataTree indices by
@@ -52,9 +66,27 @@ class FilterSpinAgent(ModuleAgent):
         if not data_lists:
             return
         self.spin_values = sorted(list(set(data_lists[0][0])))
-        self.spin_field = headers[0][0]
+        if headers[0][0] != self.spin_field:
+            self.spin_field = headers[0][0]
+            self.buildPartition()
         self.spinUpdateSignal.emit(self.spin_field, self.spin_values)
 
+    def buildPartition(self):
+        """Partitions the table of the spin field by its values so that
+           each spin step only has to slice the table.
+        """
+        self.spin_partition = FieldPartition(self.spin_field)
+        self.spin_filters = dict()
+        for index in self.requests["spinfield"].indices:
+            self.spin_partition.partition(self.datatree.getItem(index).parent())
+
+    def spinFilter(self, value):
+        """Returns the filter for the given value of the spin field."""
+        if value not in self.spin_filters:
+            self.spin_filters[value] = PartitionFilter(self.spin_partition,
+                value)
+        return self.spin_filters[value]
+
 
     def createSimpleFilter(self, index = -1):
         """Creates a SimpleFilter from the given conditions (a Clause
@@ -71,13 +103,82 @@ class FilterSpinAgent(ModuleAgent):
             for coupler in self.child_requests:
                 coupler.modifier = None
         else:
-            self.filters.append(SimpleWhereFilter(
-                Clause('=', TableAttribute(self.spin_field),
-                    self.spin_values[self.spin_selected])))
+            self.filters.append(self.spinFilter(
+                self.spin_values[self.spin_selected]))
             for coupler in self.requests.values():
                 coupler.modifier = self.filters[0]
             for coupler in self.child_requests:
                 coupler.modifier = self.filters[0]
+            if self.playing:
+                self.prefetchSteps()
+
+    def downstreamRequests(self, agent = None):
+        """Returns a list of the ModuleRequests of all Agents under the
+           given Agent, by default this one.
+        """
+        if agent is None:
+            agent = self
+        requests = list()
+        for child in agent.children:
+            requests.extend(child.requests.values())
+            requests.extend(self.downstreamRequests(child))
+        return requests
+
+    def prefetchSteps(self):
+        """Evaluates the requests under this module for the spin steps
+           following the selected one in a background thread, so that
+           their results are cached by the time the steps are shown.
+        """
+        for worker in self._prefetch_workers:
+            worker.cancel()
+
+        if not self.filters or not self.spin_values:
+            return
+        current = self.filters[0]
+
+        tasks = list()
+        for step in range(1, min(self.prefetch_steps,
+            len(self.spin_values) - 1) + 1):
+            index = (self.spin_selected + step) % len(self.spin_values)
+            spin_filter = self.spinFilter(self.spin_values[index])
+            for request in self.downstreamRequests():
+                chain = request.coupler.modifier_chain
+                if current not in chain:
+                    continue
+                chain = [spin_filter if modifier is current else modifier
+                    for modifier in chain]
+                tasks.append((request, chain))
+
+        if not tasks:
+            return
+        worker = PrefetchWorker(tasks, self)
+        worker.finished.connect(self.prefetchFinished)
+        self._prefetch_workers.add(worker)
+        worker.start()
+
+    @Slot()
+    def prefetchFinished(self):
+        """Releases finished PrefetchWorkers."""
+        for worker in list(self._prefetch_workers):
+            if worker.isFinished():
+                self._prefetch_workers.remove(worker)
+
+    def stopPrefetch(self):
+        """Cancels the PrefetchWorkers and waits for them to finish the
+           task they are on.
+        """
+        for worker in self._prefetch_workers:
+            worker.cancel()
+        for worker in self._prefetch_workers:
+            worker.wait()
+        self._prefetch_workers.clear()
+
+    def delete(self):
+        """Stops prefetching, then deletes this Agent and all its
+           children.
+        """
+        self.stopPrefetch()
+        super(FilterSpinAgent, self).delete()
 
 
 @Module("Filter Spin", FilterSpinAgent)
@@ -85,6 +186,9 @@ class FilterSpinFrame(ModuleFrame):
     """ModuleFrame for handling spin filter operations.
     """
 
+    # Milliseconds between spin steps during playback
+    play_interval = 500
+
     def __init__(self, parent, parent_frame = None, title = None):
         """Constructor for FilterSpinFrame."""
         super(FilterSpinFrame, self).__init__(parent, parent_frame, title)
@@ -94,6 +198,10 @@ class FilterSpinFrame(ModuleFrame):
         self.agent.spinUpdateSignal.connect(self.updateSpinner)
         self.droppedDataSignal.connect(self.droppedData)
 
+        self.play_timer = QTimer(self)
+        self.play_timer.setInterval(self.play_interval)
+        self.play_timer.timeout.connect(self.playStep)
+
     def createView(self):
         """Creates the module-specific view for the FilterBox module."""
         view = QWidget()
@@ -109,6 +217,11 @@ class FilterSpinFrame(ModuleFrame):
         self.spinner.valueChanged.connect(self.spinnerValueChanged)
         layout.addWidget(self.spinner)
 
+        self.play_button = QPushButton("Play")
+        self.play_button.setCheckable(True)
+        self.play_button.toggled.connect(self.playToggled)
+        layout.addWidget(self.play_button)
+
         view.setLayout(layout)
         view.resize(200, 20)
         return view
@@ -131,6 +244,27 @@ class FilterSpinFrame(ModuleFrame):
     def spinnerValueChanged(self, index):
         self.agent.createSimpleFilter(index)
 
+    @Slot(bool)
+    def playToggled(self, playing):
+        """Starts or stops stepping through the spin values."""
+        self.agent.playing = playing
+        if playing:
+            self.play_button.setText("Pause")
+            self.agent.prefetchSteps()
+            self.play_timer.start()
+        else:
+            self.play_button.setText("Play")
+            self.play_timer.stop()
+            self.agent.stopPrefetch()
+
+    @Slot()
+    def playStep(self):
+        """Moves the spinner to the next spin value, wrapping around."""
+        if not self.agent.spin_values:
+            return
+        self.spinner.setValue((self.spinner.value() + 1)
+            % len(self.agent.spin_values))
+
 
 class FilterSpinBox(QSpinBox):
     """Special spin box shows the value of the given field rather than
@@ -185,3 +319,33 @@ class FilterSpinBox(QSpinBox):
             return str(self._true_values[value])
         else:
             return ""
+
+
+class PrefetchWorker(QThread):
+    """Thread evaluating a list of (ModuleRequest, modifier chain) tasks
+       ahead of time. The results are only cached.
+    """
+
+    def __init__(self, tasks, parent = None):
+        """Construct a PrefetchWorker for the given tasks."""
+        super(PrefetchWorker, self).__init__(parent)
+
+        self.tasks = tasks
+        self.cancelled = False
+
+    def cancel(self):
+        """Skips the tasks that have not been started yet."""
+        self.cancelled = True
+
+    def run(self):
+        """Prefetch the tasks in order until cancelled. A task that raises
+           is skipped, as the same evaluation raises again when its step
+           is shown, where it can be reported.
+        """
+        for request, chain in self.tasks:
+            if self.cancelled:
+                return
+            try:
+                request.prefetch(chain)
+            except Exception:
+                continue
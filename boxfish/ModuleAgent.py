@@ -1,4 +1,4 @@
-from PySide.QtCore import Slot,Signal,QObject,QMimeData,Qt
+from PySide.QtCore import Slot,Signal,QObject,QMimeData,Qt,QThread,QTimer
 from PySide.QtGui import QWidget,QMainWindow,QDockWidget,QToolBar,\
     QLabel,QDrag,QPixmap
 from SubDomain import *
@@ -7,6 +7,11 @@ from Projection import *
 from DataModel import *
 from FilterCoupler import *
 from SceneInfo import *
+from boxfish.util.IdMap import IdMap
+from boxfish.util.LRUCache import LRUCache
+from collections import OrderedDict
+import threading
+import traceback
 
 class ModuleAgent(QObject):
     """ModuleAgent is the base class for all nodes that form the Boxfish
@@ -26,6 +31,13 @@ class ModuleAgent(QObject):
     attributeSceneUpdateSignal = Signal() # my attribute Scene updated
     requestScenesSignal        = Signal(QObject)
 
+    # True when asynchronous requests start running, False when the last
+    # of them finishes
+    requestsPendingSignal      = Signal(bool)
+
+    # Request name and traceback of an asynchronous evaluation that failed
+    requestErrorSignal         = Signal(str, str)
+
     def __init__(self, parent, datatree = None):
         """Constructor for ModuleAgent.
 
@@ -73,6 +85,19 @@ class ModuleAgent(QObject):
         self.apply_attribute_scenes = True
         self._propagate_attribute_scenes = False
 
+        # The requests of this subtree by their attribute set, kept up to
+        # date as requests change so range unions need not walk the tree
+        self.attribute_requests = dict()
+
+        # Scene changes waiting to be signalled, at most one per type of
+        # Scene (and attribute set), flushed when the event loop is idle
+        self._pending_scenes = OrderedDict()
+
+        # The RequestWorker of each request evaluated asynchronously and
+        # the callbacks awaiting their results
+        self._request_workers = dict()
+        self._request_callbacks = dict()
+
 
 
     # factory method for subclasses
@@ -103,7 +128,9 @@ class ModuleAgent(QObject):
             self.requestAttributesChanged)
         self.requests[name].attributeSceneChangedSignal.connect(
             self.sceneChanged)
+        coupler.changeSignal.connect(self.requests[name].couplerChanged)
         coupler.changeSignal.connect(self.requestedCouplerChanged)
+        self.trackRequestAttributes(self.requests[name])
 
         #Now send this new one to the parent
         self.addCouplerSignal.emit(coupler, self)
@@ -147,7 +174,9 @@ class ModuleAgent(QObject):
                will be projected onto this domain.
 
            row_aggregator
-               Aggregation operator for combining rows on an ID
+               Aggregation operator for combining rows on an ID. Not
+               applied at this time: all values of an ID, from every row
+               and attribute, are combined with attribute_aggregator.
 
            attribute_aggregator
                Aggregation operator for combining attributes (columns) for
@@ -183,6 +212,97 @@ class ModuleAgent(QObject):
         return self.requests[name].getRows()
 
 
+    def requestOnDomainAsync(self, name, callback, domain_table,
+        row_aggregator, attribute_aggregator):
+        """Like requestOnDomain but evaluated in a worker thread. The
+           callback is called in the GUI thread with the ids and values
+           once they are available. If the request changes before then,
+           the results are discarded and the callback is not called.
+        """
+        if name not in self.requests:
+            raise ValueError("No request named " + name)
+
+        self.evaluateRequestAsync(name, callback,
+            self.requests[name].aggregateDomain, domain_table,
+            row_aggregator, attribute_aggregator)
+
+
+    def requestGetRowsAsync(self, name, callback):
+        """Like requestGetRows but evaluated in a worker thread. The
+           callback is called in the GUI thread with the five return
+           values of requestGetRows unless the request changes before
+           they are available.
+        """
+        if name not in self.requests:
+            raise ValueError("No request named " + name)
+
+        self.evaluateRequestAsync(name, callback,
+            self.requests[name].getRows)
+
+
+    def evaluateRequestAsync(self, name, callback, function, *args):
+        """Evaluates function(*args) for the named request in its
+           RequestWorker and passes the results to callback in the GUI
+           thread. An evaluation waiting for an earlier one of the same
+           request to finish is replaced, and the results of the earlier
+           one are discarded.
+        """
+        request = self.requests[name]
+        request.generation += 1
+        self._request_callbacks[name] = callback
+
+        worker = self._request_workers.get(name)
+        if worker is None:
+            worker = RequestWorker(name, self)
+            worker.resultSignal.connect(self.requestWorkerResult)
+            worker.finished.connect(self.requestWorkerFinished)
+            self._request_workers[name] = worker
+
+        if not self.requestsPending():
+            self.requestsPendingSignal.emit(True)
+        worker.evaluate(request.generation, function, args)
+
+    def requestsPending(self):
+        """Returns True if any RequestWorker of this Agent is running."""
+        return any(worker.isRunning()
+            for worker in self._request_workers.itervalues())
+
+
+    # Slot(str, int, object, object) decorator after class definition
+    def requestWorkerResult(self, name, generation, result, error):
+        """Receives the results of a RequestWorker in the GUI thread and
+           passes them on unless they are stale. A failed evaluation is
+           reported through requestErrorSignal with its traceback.
+        """
+        if name not in self.requests \
+            or self.requests[name].generation != generation:
+            return
+
+        callback = self._request_callbacks.pop(name)
+        if error is not None:
+            self.requestErrorSignal.emit(name, error)
+            return
+        callback(*result)
+
+
+    @Slot()
+    def requestWorkerFinished(self):
+        """Signals when the last running RequestWorker finishes."""
+        if not self.requestsPending():
+            self.requestsPendingSignal.emit(False)
+
+    def stopRequestWorkers(self):
+        """Discards the evaluations in progress and waits for the
+           RequestWorkers to finish them.
+        """
+        for name, request in self.requests.iteritems():
+            request.generation += 1
+        self._request_callbacks.clear()
+        for worker in self._request_workers.itervalues():
+            worker.cancel()
+            worker.wait()
+
+
     # Signal decorator attached after the class.
     # @Slot(FilterCoupler, ModuleAgent)
     def addChildCoupler(self, coupler, child):
@@ -212,8 +332,10 @@ class ModuleAgent(QObject):
         if coupler in self.child_requests:
             self.child_requests.remove(coupler)
         else:
-            for key, request in self.requests.iteritems():
+            for key, request in self.requests.items():
                 if coupler == request.coupler:
+                    self.trackRequestAttributes(request, False)
+                    request.delete()
                     del self.requests[key]
 
     def registerChild(self, child):
@@ -226,6 +348,8 @@ class ModuleAgent(QObject):
         if self.propagate_module_scenes:
             child.propagate_module_scenes = True
 
+        self.indexAttributeRequests(child.attribute_requests, True)
+
         # "Adopt" child's requests
         for coupler in child.getCouplerRequests():
             my_filter = None
@@ -242,6 +366,8 @@ class ModuleAgent(QObject):
         child.sceneChangedSignal.disconnect(self.receiveSceneFromChild)
         child.requestScenesSignal.disconnect(self.sendAllScenes)
 
+        self.indexAttributeRequests(child.attribute_requests, False)
+
         # Abandon child's requests
         for coupler in self.child_requests:
             if coupler.parent == child:
@@ -260,6 +386,9 @@ class ModuleAgent(QObject):
         """Deletes this Agent and all its children."""
         for child in self.children:
             child.delete()
+        self.stopRequestWorkers()
+        for request in self.requests.itervalues():
+            request.delete()
         self.parent().unregisterChild(self)
 
     # Slot(ModuleAgent) decorator after class definition
@@ -336,6 +465,8 @@ class ModuleAgent(QObject):
            If multiple highlight lists in the HighlightScene have the same
            domain as the table, all will be applied.
 
+           The returned SubDomain holds each ID once, in ascending order.
+
            table
                TableItem or string name of a table in the DataTree.
 
@@ -361,22 +492,24 @@ class ModuleAgent(QObject):
             tableItem = table
 
         tableDomain = tableItem._table.subdomain()
-        highlights = SubDomain.instantiate(tableDomain)
-        for hs in self._highlights.highlight_sets:
-            if hs.highlights.subdomain() == tableDomain:
-                highlights.extend(hs.highlights)
-
-        if len(highlights) > 0: # We found a SubDomain match
-            return highlights
-
-        # Since there was no direct way, we need to find and apply projections
-        for hs in self._highlights.highlight_sets:
-            projection = runItem.getProjection(tableDomain,
-                hs.highlights.subdomain())
-            if projection is not None:
-                highlights.extend(projection.project(hs.highlights, tableDomain))
-
-        return highlights
+        id_arrays = [hs.ids for hs in self._highlights.highlight_sets
+            if hs.subdomain() == tableDomain]
+
+        if sum(len(ids) for ids in id_arrays) == 0:
+            # Since there was no direct way, we need to find and apply
+            # projections
+            id_arrays = list()
+            for hs in self._highlights.highlight_sets:
+                projection = runItem.getProjection(tableDomain,
+                    hs.subdomain())
+                if projection is not None and len(hs.ids) > 0:
+                    id_arrays.append(projection.project_pairs(hs.ids,
+                        tableDomain)[1])
+
+        if not id_arrays:
+            return SubDomain.instantiate(tableDomain)
+        return SubDomain.instantiate(tableDomain,
+            np.unique(np.concatenate(id_arrays)).tolist())
 
     def setHighlights(self, tables, runs, ids):
         """Sets the highlight of this particular agent and announces the change.
@@ -463,6 +596,7 @@ class ModuleAgent(QObject):
            existing scene information. If no scene information is found, it
            should add itself to the scene dict for this hierarchy.
         """
+        self.trackRequestAttributes(request)
         if scene.attributes in self.attribute_scenes_dict:
             if request.receiveAttributeScene(
                     self.attribute_scenes_dict[scene.attributes]):
@@ -470,6 +604,40 @@ class ModuleAgent(QObject):
         else:
             self.sceneChanged(scene)
 
+    def trackRequestAttributes(self, request, present = True):
+        """Files the given request of this Agent under its current
+           attribute set in attribute_requests here and in all ancestors,
+           or removes it if present is False.
+        """
+        old_attributes = request.tracked_attributes
+        if present:
+            request.tracked_attributes = frozenset(request.scene.attributes)
+        else:
+            request.tracked_attributes = None
+        if old_attributes is not None:
+            self.indexAttributeRequests({ old_attributes : set([request]) },
+                False)
+        if request.tracked_attributes is not None:
+            self.indexAttributeRequests(
+                { request.tracked_attributes : set([request]) }, True)
+
+    def indexAttributeRequests(self, attribute_requests, add):
+        """Adds (or removes if add is False) the given dict of attribute
+           sets to requests to attribute_requests of this Agent and all of
+           its ancestors.
+        """
+        agent = self
+        while isinstance(agent, ModuleAgent):
+            for attributes, requests in attribute_requests.items():
+                if add:
+                    agent.attribute_requests.setdefault(attributes,
+                        set()).update(requests)
+                elif attributes in agent.attribute_requests:
+                    agent.attribute_requests[attributes] -= requests
+                    if not agent.attribute_requests[attributes]:
+                        del agent.attribute_requests[attributes]
+            agent = agent.parent()
+
     # TODO: While this does recalculate the attribute ranges for the 
     # scene's new attributes, it must be retriggered for the attributes
     # that got replaced too...
@@ -477,7 +645,11 @@ class ModuleAgent(QObject):
         """Finds the union of all ranges of AttributeScenes with the given
            attributes that exist in this subtree.
         """
-        range_list = self.getRanges(attributes)
+        range_list = [request.scene.local_max_range for request
+            in self.attribute_requests.get(attributes, ())
+            if request.scene.attributes == attributes]
+        if not range_list: # Not tracked, search the subtree
+            range_list = self.getRanges(attributes)
 
         min_range = range_list[0][0]
         max_range = range_list[0][1]
@@ -535,8 +707,26 @@ class ModuleAgent(QObject):
 
     @Slot(Scene)
     def sceneChanged(self, scene):
-        """Signals a Scene in this subtree has changed."""
-        self.sceneChangedSignal.emit(scene.copy(), self)
+        """Signals a Scene in this subtree has changed. Changes are
+           coalesced per type of Scene, and per attribute set for
+           AttributeScenes, and signalled once the event loop is idle,
+           so a burst of changes propagates through the tree only once.
+        """
+        if isinstance(scene, AttributeScene):
+            key = (AttributeScene, frozenset(scene.attributes))
+        else:
+            key = (type(scene), None)
+        if not self._pending_scenes:
+            QTimer.singleShot(0, self.flushScenes)
+        self._pending_scenes[key] = scene
+
+    @Slot()
+    def flushScenes(self):
+        """Signals the latest state of each changed Scene."""
+        pending = self._pending_scenes.values()
+        self._pending_scenes.clear()
+        for scene in pending:
+            self.sceneChangedSignal.emit(scene.copy(), self)
 
     # Slot(Scene, ModuleAgent) decorator after class definition
     def receiveSceneFromChild(self, scene, source_agent):
@@ -628,8 +818,75 @@ class ModuleAgent(QObject):
 ModuleAgent.addChildCoupler = Slot(FilterCoupler, ModuleAgent)(ModuleAgent.addChildCoupler)
 ModuleAgent.receiveSceneFromChild = Slot(Scene, ModuleAgent)(ModuleAgent.receiveSceneFromChild)
 ModuleAgent.sendAllScenes = Slot(ModuleAgent)(ModuleAgent.sendAllScenes)
+ModuleAgent.requestWorkerResult = Slot(str, int, object, object)(
+    ModuleAgent.requestWorkerResult)
+
 
 
+def copyResult(value):
+    """Copies the lists, tuples and arrays nested in a cached result so
+       callers may modify what they receive. Other values, such as the
+       DataTree items in some results, are shared.
+    """
+    if isinstance(value, list):
+        return [copyResult(x) for x in value]
+    elif isinstance(value, tuple):
+        return tuple(copyResult(x) for x in value)
+    elif isinstance(value, np.ndarray):
+        return value.copy()
+    return value
+
+
+def CachedResult(evaluate):
+    """Decorator caches the results of a ModuleRequest evaluation in the
+       request's LRU cache, keyed by the evaluation, the filters in the
+       request's modifier chain, the request's indices and the arguments.
+       Index lists are keyed by the DataTree items they refer to. Results
+       are not cached if the request changes while they are evaluated.
+       Callers receive copies of the returned lists, at every level of
+       nesting.
+
+       The evaluation may be given another modifier_chain keyword
+       argument to apply instead of the coupler's. Such results are
+       prefetched frames kept in the DataTree's frame cache, which
+       outlives changes to the coupler. Frames are keyed by the id of
+       the request rather than the request itself, so the cache does not
+       keep closed modules alive.
+    """
+    def cached_evaluate(self, *args, **kwargs):
+        arguments = list()
+        for arg in args:
+            if isinstance(arg, list):
+                arg = tuple(self.datatree.getItem(x) for x in arg)
+            arguments.append(arg)
+        arguments = tuple(arguments)
+
+        # Captured before evaluating as the request may change meanwhile
+        generation = self.generation
+        indices = tuple(self.datatree.getItem(x)
+            for x in (self._indices or ()))
+
+        modifier_chain = kwargs.get('modifier_chain')
+        prefetch = modifier_chain is not None
+        if not prefetch:
+            modifier_chain = self.coupler.modifier_chain
+            self.evaluations.put((evaluate.__name__, arguments), args)
+        key = (evaluate.__name__, tuple(modifier_chain), indices, arguments)
+
+        result = self.result_cache.get(key)
+        if result is None:
+            result = self.datatree.frame_cache.get((id(self), ) + key)
+        if result is None:
+            result = evaluate(self, *args, modifier_chain = modifier_chain)
+            if prefetch and self.generation == generation:
+                self.datatree.frame_cache.put((id(self), ) + key, result)
+        if not prefetch and self.generation == generation:
+            self.result_cache.put(key, result)
+        return copyResult(result)
+
+    cached_evaluate.__name__ = evaluate.__name__
+    cached_evaluate.__doc__ = evaluate.__doc__
+    return cached_evaluate
 
 
 class ModuleRequest(QObject):
@@ -638,17 +895,16 @@ class ModuleRequest(QObject):
        by the name member of the class. Please keep names unique within a
        single module as they are used to differentiate requests.
     """
-    operator = {
-        'sum' : sum,
-        'mean' : lambda x: sum(x) / float(len(x)),
-        'max' : max,
-        'min' : min,
-    }
-
     indicesChangedSignal = Signal(str)
     attributesChangedSignal = Signal(frozenset, QObject)
     attributeSceneChangedSignal = Signal(AttributeScene)
 
+    # Number of evaluated results kept by each request
+    result_cache_size = 8
+
+    # Number of distinct evaluations remembered for prefetching
+    evaluation_history_size = 4
+
     def __init__(self, datatree, name, coupler, subdomain = None,
         indices = list()):
         """Construct a ModuleRequest object with the given name, coupler,
@@ -663,6 +919,21 @@ class ModuleRequest(QObject):
         self.subdomain = subdomain
         self._indices = indices
 
+        # Incremented whenever the results of this request may change so
+        # that stale asynchronous results can be discarded
+        self.generation = 0
+
+        # Attribute set under which the owning agent files this request
+        self.tracked_attributes = None
+
+        # Results of evaluations that have not been invalidated by a
+        # change of indices or filters
+        self.result_cache = LRUCache(self.result_cache_size)
+
+        # Arguments of the evaluations made through the coupler's filters,
+        # repeated with other filters when prefetching
+        self.evaluations = LRUCache(self.evaluation_history_size)
+
         if self._indices is None:
             self.scene = AttributeScene(frozenset())
         else:
@@ -676,7 +947,12 @@ class ModuleRequest(QObject):
 
     @indices.setter
     def indices(self, indices):
+        changed = indices != self._indices
         self._indices = indices
+        self.generation += 1
+        if changed:
+            self.result_cache.clear()
+            self.clearFrames()
         if self._indices is None or len(self._indices) == 0:
             self.scene.attributes = set()
         else:
@@ -727,6 +1003,36 @@ class ModuleRequest(QObject):
         """Propagate signal that this request's attribute scene has changed."""
         self.attributeSceneChangedSignal.emit(scene)
 
+    @Slot(FilterCoupler)
+    def couplerChanged(self, coupler):
+        """Invalidates running evaluations and cached results when the
+           filters change.
+        """
+        self.generation += 1
+        self.result_cache.clear()
+
+    def clearFrames(self):
+        """Discards the results prefetched for this request from the
+           DataTree's frame cache.
+        """
+        request_id = id(self)
+        self.datatree.frame_cache.purge(lambda key: key[0] == request_id)
+
+    def delete(self):
+        """Discards the evaluations in progress and the prefetched results
+           of this request, which is no longer used.
+        """
+        self.generation += 1
+        self.clearFrames()
+
+    def prefetch(self, modifier_chain):
+        """Repeats the recent evaluations of this request with the given
+           filters in place of those of the coupler, keeping the results
+           in the DataTree's frame cache until the coupler has them.
+        """
+        for (name, arguments), args in self.evaluations.items():
+            getattr(self, name)(*args, modifier_chain = modifier_chain)
+
     def sortIndicesByTable(self, indexList):
         """Creates an iterator of passed indices grouped by the tableItems
            that they come from.
@@ -744,8 +1050,9 @@ class ModuleRequest(QObject):
             return False
         return True
 
+    @CachedResult
     def aggregateDomain(self, domain_table, row_aggregator,
-        attribute_aggregator):
+        attribute_aggregator, modifier_chain = None):
         """Gets results of the request, aggregated by the domain of
            the domain table.
 
@@ -754,12 +1061,17 @@ class ModuleRequest(QObject):
                will be projected onto this domain.
 
            row_aggregator
-               Aggregation operator for combining rows on an ID
+               Aggregation operator for combining rows on an ID. Not
+               applied at this time: all values of an ID, from every row
+               and attribute, are combined with attribute_aggregator.
 
            attribute_aggregator
                Aggregation operator for combining attributes (columns) for
                each row if multiple indices have been added to this Request.
 
+           modifier_chain
+               Filters to apply instead of those of the request's coupler.
+
            Returns:
                ids
                   List of ids from the domain_table.
@@ -770,26 +1082,25 @@ class ModuleRequest(QObject):
         if not self.preprocess():
             return  list(), list()
 
-        # Get mapping of group_by_attributes to their subdomain ID
-        # THIS IS PAINFULLY SLOW
+        domain_subdomain = domain_table._table.subdomain()
 
-        # This is where we store intermediate values
-        aggregate_values = dict()
+        # Domain ids and values of every (row, attribute) that is
+        # aggregated, collected per table
+        domain_id_arrays = list()
+        value_arrays = list()
 
         self.attribute_groups = self.sortIndicesByTable(self._indices)
 
         for table, attribute_group in self.attribute_groups:
             # Determine if projection exists, if not, skip
             projection = domain_table.getRun().getProjection(
-                domain_table._table.subdomain(),
-                table._table.subdomain())
+                domain_subdomain, table._table.subdomain())
             if projection is None:
                 continue
 
             # Apply filters
-            identifiers = table._table.identifiers()
-            for modifier in self.coupler.modifier_chain:
-                identifiers = modifier.process(table, identifiers)
+            identifiers = self.datatree.filter_cache.identifiers(table,
+                modifier_chain)
 
             # Determine the attributes
             attributes = [self.datatree.getItem(x).name
@@ -799,50 +1110,73 @@ class ModuleRequest(QObject):
             # Get the attributes and ids for these identifiers
             attribute_values = table._table.attributes_by_identifiers(
                 identifiers, attributes, False) # We don't want unique values
+            table_ids = np.asarray(attribute_values[0])
+            table_values = np.column_stack([np.asarray(x, dtype = np.float64)
+                for x in attribute_values[1:]])
 
             if isinstance(projection, IdentityProjection):
                 # Since the projection is Identity, we don't need to process it
-                for row_values in zip(*attribute_values):
-                    domain_id = row_values[0]
-                    if domain_id in aggregate_values:
-                        aggregate_values[domain_id].extend(row_values[1:])
-                    else:
-                        aggregate_values[domain_id] = list(row_values[1:])
+                rows = np.arange(len(table_ids))
+                domain_ids = table_ids
             else: # Other type of projection
-                # Find relevant projection per id. Each id may appear in 
-                # in multiple rows, so we build this on the unique set of
-                # ids to minimize calculated projections. Then we use 
-                # the built dict to put the rest of the row values in 
-                # the proper place
-                projection_memo = dict() # store projections
-                for table_id in set(attribute_values[0]): # unique ids
-                    domain_ids = projection.project(
-                        SubDomain.instantiate(table._table.subdomain(),
-                            [table_id]),
-                        domain_table._table.subdomain())
-                    projection_memo[table_id] = domain_ids
-
-                # Collect attributes onto proper domain IDs
-                for row_values in zip(*attribute_values):
-                    domain_ids = projection_memo[row_values[0]]
-                    for domain_id in domain_ids:
-                        if domain_id in aggregate_values:
-                            aggregate_values[domain_id].extend(row_values[1:])
-                        else:
-                            aggregate_values[domain_id] = list(row_values[1:])
-
-        # Then get the IDs from the group by table that matter
-        # and associate them with these attributes
-        values = list()
-        ids = list()
-        for domain_id, agge_values in aggregate_values.iteritems():
-            ids.append(domain_id)
-            values.append(self.operator[attribute_aggregator](agge_values))
-
-        return ids, values
-
-
-    def getRows(self):
+                rows, domain_ids = self.projectRows(projection, table_ids,
+                    domain_subdomain)
+
+            # Every attribute of a row goes to the row's domain ids
+            domain_id_arrays.append(np.repeat(domain_ids,
+                table_values.shape[1]))
+            value_arrays.append(table_values[rows].ravel())
+
+        if not domain_id_arrays:
+            return list(), list()
+
+        domain_ids = np.concatenate(domain_id_arrays)
+        values = np.concatenate(value_arrays)
+
+        # Aggregate on the dense positions of the domain ids
+        id_map = domain_table.getRun().getIdMap(domain_subdomain)
+        if id_map is not None:
+            positions = id_map.positions(domain_ids)
+        if id_map is None or np.any(positions < 0):
+            id_map = IdMap(domain_ids)
+            positions = id_map.positions(domain_ids)
+
+        present, aggregates = self.aggregatePositions(positions, values,
+            len(id_map), attribute_aggregator)
+
+        return id_map.ids[present].tolist(), aggregates[present].tolist()
+
+
+    def aggregatePositions(self, positions, values, size, operator):
+        """Aggregates the values that share a position with the named
+           operator ('sum', 'mean', 'max' or 'min').
+
+           Returns a boolean array marking the positions in range(size)
+           that received values and an array of the aggregated value of
+           every position.
+        """
+        counts = np.bincount(positions, minlength = size)
+        present = counts > 0
+
+        if operator == 'sum' or operator == 'mean':
+            aggregates = np.bincount(positions, weights = values,
+                minlength = size)
+            if operator == 'mean':
+                aggregates[present] /= counts[present]
+        elif operator == 'max':
+            aggregates = np.full(size, -np.inf)
+            np.maximum.at(aggregates, positions, values)
+        elif operator == 'min':
+            aggregates = np.full(size, np.inf)
+            np.minimum.at(aggregates, positions, values)
+        else:
+            raise ValueError("Unknown aggregation operator " + str(operator))
+
+        return present, aggregates
+
+
+    @CachedResult
+    def getRows(self, modifier_chain = None):
         """Gets all of the attributes from the request, grouped by
            the table from which they come from. There is no other grouping,
            this returns the raw rows which may have rows with duplicate
@@ -870,6 +1204,8 @@ class ModuleRequest(QObject):
                a list for each attribute in headers that contains the
                values (rows data) for those attributes.
 
+           The rows are filtered by modifier_chain if given, otherwise by
+           the filters of the request's coupler.
         """
         if not self.preprocess():
             return None, None, None, None, None # Ewww, FIXME
@@ -887,9 +1223,8 @@ class ModuleRequest(QObject):
                 for x in attribute_group]
             headers.append(attributes[:])
             attributes.insert(0, table['field'])
-            identifiers = table._table.identifiers()
-            for modifier in self.coupler.modifier_chain:
-                identifiers = modifier.process(table, identifiers)
+            identifiers = self.datatree.filter_cache.identifiers(table,
+                modifier_chain)
             attribute_list = table._table.attributes_by_identifiers(
                 identifiers, attributes, False)
             data_list.append(attribute_list[1:])
@@ -897,8 +1232,9 @@ class ModuleRequest(QObject):
 
         return table_list, run_list, id_list, headers, data_list
 
+    @CachedResult
     def generalizedGroupBy(self, desired_indices, desired_operator,
-        group_operator):
+        group_operator, modifier_chain = None):
         """Groups some function of desired_indices by some function of
            the Request's indices.
 
@@ -911,6 +1247,8 @@ class ModuleRequest(QObject):
            grouped_operator
                Function with which to aggregate the group by (our) indices
 
+           modifier_chain
+               Filters to apply instead of those of the request's coupler.
 
             The returned ids refer to the domain of the first attribute in
             this Request's indices.
@@ -955,20 +1293,24 @@ class ModuleRequest(QObject):
         # Then we form Cartesian products of the attributes where each 
         # product shares the same associated id. Finally we apply the
         # grouped_operator to each of these to form the group-by groups.
+        # All of this is done with id-sorted numpy arrays: the Cartesian
+        # products per id are joins of the tables on the id.
 
-        # group by aggregator dict
-        group_dict, group_table = self.projectToFirstTable(self._indices)
+        # group by rows per table, keyed by the first table's ids
+        group_rows, group_table = self.projectToFirstTable(self._indices,
+            modifier_chain)
 
         # Next we repeat the process for the desired_indices
-        desired_dict, desired_table = self.projectToFirstTable(desired_indices)
+        desired_rows, desired_table = self.projectToFirstTable(
+            desired_indices, modifier_chain)
 
-        # Now we do the Cartesian product on each group_dict[domain_id]
-        # At this point, group_dict[domain_id] is a dict table->row_values
-        # By the end of this operation, each domain_id should be associated
-        # with a list of products. Each product is a list of lists of 
-        # row_values, one for each table.
-        group_cart = self.cartesianCompress(group_dict, group_operator)
-        desired_cart = self.cartesianCompress(desired_dict, desired_operator)
+        # Now we do the Cartesian product for each domain_id. By the end
+        # of this operation, each domain_id is paired with the unique
+        # values of the operator on its products.
+        group_ids, group_cart = self.cartesianCompress(group_rows,
+            group_operator)
+        desired_ids, desired_cart = self.cartesianCompress(desired_rows,
+            desired_operator)
 
         # Then we project the desired_indices domain ids onto the 
         # group_indices domain_ids.
@@ -979,100 +1321,129 @@ class ModuleRequest(QObject):
                 + " between " + str(group_table.name) + " and "
                 + str(desired_table.name))
 
-        import itertools
-        ids = list()
-        group_values = list()
-        desired_values = list()
         if isinstance(projection, IdentityProjection):
-            for desired_id, d_values in desired_cart.items():
-                g_values = group_cart[desired_id]
-                cart_product = itertools.product(d_values, g_values)
-                for d, g in cart_product:
-                    ids.append(desired_id)
-                    desired_values.append(d)
-                    group_values.append(g)
+            ids = desired_ids
+            d_index = np.arange(len(desired_ids))
         else:
-            for desired_id, d_values in desired_cart.items():
-                group_ids = projection.project(
-                    SubDomain.instantiate(desired_table._table.subdomain(),
-                        [desired_id]),
-                    group_table._table.subdomain())
-                for group_id in group_ids:
-                    if group_id in group_cart:
-                        g_values = group_cart[group_id]
-                        cart_product = itertools.product(d_values, g_values)
-                        for d, g in cart_product:
-                            ids.append(group_id)
-                            desired_values.append(d)
-                            group_values.append(g)
+            d_index, ids = self.projectRows(projection, desired_ids,
+                group_table._table.subdomain())
 
-        return group_table, ids, group_values, desired_values
+        # Cross every desired value with every group value of its id
+        left, right = self.joinSortedIds(ids, group_ids)
 
+        return group_table, ids[left].tolist(), group_cart[right].tolist(), \
+            desired_cart[d_index[left]].tolist()
 
-    def cartesianCompress(self, cart_dict, operator):
-        """Takes a dict of the type returned from projectToFirstTable and
-           compresses it to:
 
-               first_table_id -> list of values
+    def cartesianCompress(self, table_rows, operator):
+        """Takes a list of the type returned from projectToFirstTable and
+           compresses it to two arrays, first table ids and values, sorted
+           by id, where the values of an id are the unique results of
+           the operator applied to each product from the Cartesian
+           product of that id's rows in all of the tables.
 
-           where each value in the list of values represents the operator
-           applied to a product from the Cartesian product of the lists
-           in the cart_dict.
+           Example: rows of id 0 in t1 = [[0, 1], [2, 3]]
+                    rows of id 0 in t2 = [[1, 1, 1], [2, 2, 2]]
 
-           Example: cart_dict[0][t1] = [[0, 1], [2, 3]]
-                    cart_dict[0][t2] = [[1, 1, 1], [2, 2, 2]]
-
-                    return_dict[0] = unique[ operator([0, 1], [1, 1, 1]),
+                    values of id 0 = unique[ operator([0, 1], [1, 1, 1]),
                                              operator([0, 1], [2, 2, 2]),
                                              operator([2, 3], [1, 1, 1]),
                                              operator([2, 3], [2, 2, 2]) ]
         """
+        # The operator over the concatenated rows of a product can be
+        # built from partial results of each row: a (sum, count) pair for
+        # sum and mean, the extreme value for max and min.
+        if operator == 'sum' or operator == 'mean':
+            partial = lambda values: np.column_stack((values.sum(axis = 1),
+                np.tile(float(values.shape[1]), len(values))))
+            combine = np.add
+        elif operator == 'max':
+            partial = lambda values: values.max(axis = 1)[:, np.newaxis]
+            combine = np.maximum
+        elif operator == 'min':
+            partial = lambda values: values.min(axis = 1)[:, np.newaxis]
+            combine = np.minimum
+        else:
+            raise ValueError("Unknown aggregation operator " + str(operator))
 
-        return_dict = dict()
-
-        import itertools
-        for key in cart_dict: # id
-            values = list() # Aggregated values
-            tables = list()  # Participating Tables
-            counts = list()  # How many rows saved for each table
-            for table in cart_dict[key]:
-                #table_list.append(cart_dict[key][table])
-                tables.append(table)
-                counts.append(range(len(cart_dict[key][table])))
-
-            #value_tuples = itertools.product(*table_list)
-            indices = itertools.product(*counts)
-            for index_set in indices:
-                vals_to_combine = list()
-                for i, index in enumerate(list(index_set)):
-                    vals_to_combine.extend(cart_dict[key][tables[i]][index])
-
-                values.append(self.operator[operator](vals_to_combine))
+        ids, values = table_rows[0]
+        partials = partial(values)
+        for table_ids, table_values in table_rows[1:]:
+            left, right = self.joinSortedIds(ids, table_ids)
+            ids = ids[left]
+            partials = combine(partials[left], partial(table_values)[right])
 
-            return_dict[key] = list(set(values))
+        if operator == 'mean':
+            results = partials[:, 0] / partials[:, 1]
+        else:
+            results = partials[:, 0]
+
+        # Keep the unique values per id, sorted by id
+        if len(ids) == 0:
+            return ids, results
+        order = np.lexsort((results, ids))
+        ids = ids[order]
+        results = results[order]
+        keep = np.ones(len(ids), dtype = bool)
+        keep[1:] = (ids[1:] != ids[:-1]) | (results[1:] != results[:-1])
+        return ids[keep], results[keep]
+
+
+    def joinSortedIds(self, ids, sorted_ids):
+        """Pairs every entry of ids with every entry of sorted_ids that has
+           the same id. Returns two index arrays, into ids and into
+           sorted_ids, describing those pairs.
+        """
+        ids = np.asarray(ids)
+        sorted_ids = np.asarray(sorted_ids)
+        starts = np.searchsorted(sorted_ids, ids, side = 'left')
+        counts = np.searchsorted(sorted_ids, ids, side = 'right') - starts
+        left = np.repeat(np.arange(len(ids)), counts)
+        right = np.arange(len(left)) \
+            - np.repeat(np.cumsum(counts) - counts, counts) \
+            + np.repeat(starts, counts)
+        return left, right
+
+
+    def projectRows(self, projection, ids, destination):
+        """Projects each of the given ids onto destination with a single
+           call to the projection. Returns two arrays, the index into ids
+           of each resulting pair and the destination id of that pair.
+        """
+        ids = np.asarray(ids)
+        unique_ids, rows = np.unique(ids, return_inverse = True)
+        key_index, projected_ids = projection.project_pairs(unique_ids,
+            destination)
 
-        return return_dict
+        # Every row gets all pairs of its id
+        left, right = self.joinSortedIds(rows, key_index)
+        return left, projected_ids[right]
 
 
-    def projectToFirstTable(self, indices):
+    def projectToFirstTable(self, indices, modifier_chain):
         """Gets the data from a set of indicies and and projects that
            data onto the ids of the first table represented in those
            indices.
 
-           This is returned as a dict of dict of lists of lists:
-               first_table_id -> dict_of_all_tables -> list of lists of
-                                                       returned row values
+           This is returned as a list with an entry per table of
+               (first_table_ids, row values)
+           where first_table_ids is a sorted array of the first table ids
+           onto which the rows project and row values is a 2D array with
+           the values of the requested attributes of the corresponding row.
 
            Also returns the first_table corresponding to the first_table_ids
+
+           The rows of every table are filtered by modifier_chain.
         """
         # Break our indices into Tables
         attribute_groups = self.sortIndicesByTable(indices)
 
         domain_table = None
-        group_dict = dict()
+        table_rows = list()
         for table, attribute_group in attribute_groups:
             if domain_table is None: # First table is our domain table
                 domain_table = table
+                projection = None
             else:
                 # Determine if projection exists, if not, error
                 projection = domain_table.getRun().getProjection(
@@ -1089,72 +1460,87 @@ class ModuleRequest(QObject):
             attributes.insert(0, table['field'])
 
             # Apply filters
-            identifiers = table._table.identifiers()
-            for modifier in self.coupler.modifier_chain:
-                identifiers = modifier.process(table, identifiers)
+            identifiers = self.datatree.filter_cache.identifiers(table,
+                modifier_chain)
 
             # Get values
             attribute_values = table._table.attributes_by_identifiers(
                 identifiers, attributes, False)
+            table_ids = np.asarray(attribute_values[0])
+            values = np.column_stack([np.asarray(x, dtype = np.float64)
+                for x in attribute_values[1:]])
+
+            # Rows of tables other than the first one go to every id their
+            # id projects onto. Rows whose ids do not project onto any id
+            # drop out when crossing the tables.
+            if projection is None \
+                or isinstance(projection, IdentityProjection):
+                domain_ids = table_ids
+                rows = np.arange(len(table_ids))
+            else:
+                rows, domain_ids = self.projectRows(projection, table_ids,
+                    domain_table._table.subdomain())
+
+            order = np.argsort(domain_ids, kind = 'mergesort')
+            table_rows.append((domain_ids[order], values[rows[order]]))
+
+        return table_rows, domain_table
+
+
+class RequestWorker(QThread):
+    """Evaluates the operations of one ModuleRequest outside of the GUI
+       thread, one at a time. An operation queued while another runs
+       replaces any operation still waiting, so only the latest one is
+       evaluated next. The results are emitted through resultSignal,
+       which is delivered to receivers in the GUI thread through a queued
+       connection.
+    """
 
-            # Add these values to the dict
-            # In the first table we add indiscriminately
-            if domain_table == table:
-                for row_values in zip(*attribute_values):
-                    domain_id = row_values[0]
-                    if domain_id in group_dict:
-                        if table not in group_dict[domain_id]:
-                            group_dict[domain_id][table] = list()
-                        group_dict[domain_id][table].append(row_values[1:])
-                    else:
-                        group_dict[domain_id] = dict()
-                        group_dict[domain_id][table] = list()
-                        group_dict[domain_id][table].append(row_values[1:])
-            # In the second table, we add only if the ID already exists
-            # and we delete any ID that is unmarked at the end of it.
-            # The reason is because we are crossing the IDs in all tables
-            # and if one Table does not map, that entire ID is going to
-            # cross to no values
+    # request name, request generation, results, traceback or None
+    resultSignal = Signal(str, int, object, object)
+
+    def __init__(self, name, parent = None):
+        """Construct a RequestWorker for the request of the given name.
+        """
+        super(RequestWorker, self).__init__(parent)
+
+        self.name = name
+        self._task = None
+        self._running = False
+        self._lock = threading.Lock()
+
+    def evaluate(self, generation, function, args):
+        """Queues function(*args) for the given request generation and
+           starts the thread unless it is already running.
+        """
+        with self._lock:
+            self._task = (generation, function, args)
+            start = not self._running
+            self._running = True
+        if start:
+            self.wait() # The previous run may not have returned yet
+            self.start()
+
+    def cancel(self):
+        """Drops the operation waiting to be evaluated, if any."""
+        with self._lock:
+            self._task = None
+
+    def run(self):
+        """Evaluate the queued operations and emit their results."""
+        while True:
+            with self._lock:
+                task = self._task
+                self._task = None
+                if task is None:
+                    self._running = False
+                    return
+
+            generation, function, args = task
+            try:
+                result = function(*args)
+            except Exception:
+                self.resultSignal.emit(self.name, generation, None,
+                    traceback.format_exc())
             else:
-                current_ids = group_dict.keys()
-                if isinstance(projection, IdentityProjection):
-                    # Since projection is identity, we can skip doing it
-                    for row_values in zip(*attribute_values):
-                        domain_id = row_values[0]
-                        if domain_id in group_dict:
-                            # Only add that which has an id already
-                            current_ids.remove(domain_id)
-                            if table not in group_dict[domain_id]:
-                                group_dict[domain_id][table] = list()
-                            group_dict[domain_id][table].append(row_values[1:])
-                    for domain_id in current_ids:
-                        # Delete the ones that didn't appear in this table
-                        del group_dict[domain_id]
-                else: # Other type of projection (ugh)
-                    # Find relevant projection per id. Each id may appear in 
-                    # in multiple rows, so we build this on the unique set of
-                    # ids to minimize calculated projections. Then we use 
-                    # the built dict to put the rest of the row values in 
-                    # the proper place
-                    projection_memo = dict() # store projections
-                    for table_id in set(*attribute_values[0]):
-                        domain_ids = projection.project(
-                            Subdomain.instantiate(table._table.subdomain(),
-                                [table_id]), domain_table._table.subdomain())
-                        projection_memo[table_id] = domain_ids
-
-                    for row_values in zip(*attribute_values):
-                        domain_ids = projection_memo[row_values[0]]
-                        for domain_id in domain_ids:
-                            if domain_id in group_dict:
-                                current_ids.remove(domain_id)
-                                if table not in group_dict[domain_id]:
-                                    group_dict[domain_id][table] = list()
-                                group_dict[domain_id][table].append(
-                                    row_values[1:])
-
-                    for domain_id in current_ids:
-                        # Delete the ones that didn't appear in this table
-                        del group_dict[domain_id]
-
-        return group_dict, domain_table
+                self.resultSignal.emit(self.name, generation, result, None)
@@ -2,7 +2,7 @@ from PySide.QtCore import Slot,Signal,QObject,QMimeData,Qt,QSize
 from PySide.QtGui import QWidget,QMainWindow,QDockWidget,\
     QLabel,QDrag,QPixmap,QDialog,QFrame,QGridLayout,QSizePolicy,\
     QVBoxLayout,QPalette,QPainter,QTabWidget,QCheckBox,QScrollArea,\
-    QBrush,QSpacerItem,QPainterPath,QGroupBox
+    QBrush,QSpacerItem,QPainterPath,QGroupBox,QProgressBar,QMessageBox
 from SceneInfo import *
 from GUIUtils import *
 from DataModel import DataIndexMime
@@ -105,6 +105,17 @@ class ModuleFrame(QMainWindow):
         if isinstance(self.parent(), BFDockWidget):
             layout.addWidget(DragDockLabel(self.parent()),0, 0, 1, 2)
 
+        # Busy indicator shown while the agent evaluates requests in the
+        # background
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setTextVisible(False)
+        self.progress_bar.setMaximumHeight(8)
+        self.progress_bar.setVisible(False)
+        self.agent.requestsPendingSignal.connect(self.progress_bar.setVisible)
+        self.agent.requestErrorSignal.connect(self.requestError)
+        layout.addWidget(self.progress_bar, 99, 0, 1, 2)
+
         # TODO: Replace magic number with not-magic constant
         layout.addWidget(self.view, 100, 0, 1, 2) # Add view at bottom
         layout.setRowStretch(100, 5) # view has most row stretch
@@ -120,6 +131,13 @@ class ModuleFrame(QMainWindow):
         self.dialog = list()
 
 
+    @Slot(str, str)
+    def requestError(self, name, error):
+        """Reports a request of the agent that failed to evaluate."""
+        QMessageBox.warning(self, "Request Failed",
+            "Could not evaluate " + name + " for " + self.display_name
+            + ":\n\n" + error)
+
     def createView(self):
         """This function should be re-implemented to create and return
            the subclass-specific view/GUI as a single widget. This widget
@@ -1,5 +1,9 @@
+import hashlib
+import numpy as np
 from SubDomain import *
 from Query import *
+from boxfish.util.IdMap import IdMap
+from boxfish.util.LRUCache import LRUCache
 
 def InputFileKey(input_file_key, enabled = True):
     """Decorator associates the key from a Boxfish meta file with a type
@@ -14,9 +18,125 @@ def InputFileKey(input_file_key, enabled = True):
     return input_file_key_inner
 
 
+def CachedProjection(project):
+    """Decorator caches the results of a Projection's project or
+       project_pairs method in the Projection's LRU cache, keyed by the
+       method, the destination and a fingerprint of the projected IDs.
+       Callers receive a copy of the cached SubDomain or arrays.
+    """
+    def cached_project(self, subdomain, destination):
+        ids = np.asarray(subdomain)
+        if ids.dtype == object:
+            fingerprint = tuple(ids)
+        else:
+            fingerprint = hashlib.md5(ids.tostring()).hexdigest()
+        key = (project.__name__, destination, ids.dtype.str, len(ids),
+            fingerprint)
+
+        result = self.project_cache.get(key)
+        if result is None:
+            result = project(self, subdomain, destination)
+            self.project_cache.put(key, result)
+        if isinstance(result, tuple):
+            return tuple(np.array(x) for x in result)
+        return SubDomain.instantiate(destination, result)
+
+    cached_project.__name__ = project.__name__
+    cached_project.__doc__ = project.__doc__
+    return cached_project
+
+
+def _unique_pairs(source_index, destination_ids):
+    """Removes duplicate (source_index, destination_id) pairs and returns
+       the remaining pairs sorted by source index.
+    """
+    source_index = np.asarray(source_index, dtype = np.int64)
+    destination_ids = np.asarray(destination_ids)
+    if len(source_index) == 0:
+        return source_index, destination_ids
+    order = np.lexsort((destination_ids, source_index))
+    source_index = source_index[order]
+    destination_ids = destination_ids[order]
+    keep = np.ones(len(order), dtype = bool)
+    keep[1:] = (source_index[1:] != source_index[:-1]) \
+        | (destination_ids[1:] != destination_ids[:-1])
+    return source_index[keep], destination_ids[keep]
+
+
+def _build_adjacency(keys, values, id_map = None):
+    """Builds a compressed adjacency from parallel arrays of keys and
+       values. Returns (id_map, offsets, values) where the values of the
+       key at position i of the IdMap are values[offsets[i]:offsets[i+1]].
+       The keys are placed by the given IdMap if it holds all of them,
+       otherwise by an IdMap of the keys. Duplicate key-value pairs are
+       removed.
+    """
+    keys = np.asarray(keys)
+    values = np.asarray(values)
+    key_index = None
+    if id_map is not None:
+        key_index = id_map.positions(keys)
+        if np.any(key_index < 0):
+            key_index = None
+    if key_index is None:
+        id_map = IdMap(keys)
+        key_index = id_map.positions(keys)
+    key_index, values = _unique_pairs(key_index, values)
+    offsets = np.zeros(len(id_map) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum(np.bincount(key_index, minlength = len(id_map)))
+    return id_map, offsets, values
+
+
+def _expand_adjacency(adjacency, ids):
+    """Looks up each of the given ids in an adjacency made by
+       _build_adjacency and returns (index into ids, value) pairs for
+       all of their values. IDs not in the adjacency yield no pairs.
+    """
+    id_map, offsets, values = adjacency
+    ids = np.asarray(ids)
+    if len(id_map) == 0 or len(ids) == 0:
+        return np.zeros(0, dtype = np.int64), values[:0]
+    positions = id_map.positions(ids)
+    found = positions >= 0
+    id_index = np.arange(len(ids))[found]
+    starts = offsets[positions[found]]
+    counts = offsets[positions[found] + 1] - starts
+    source_index = np.repeat(id_index, counts)
+    # Position of each pair within its run of values, offset to its start
+    value_index = np.arange(len(source_index)) \
+        - np.repeat(np.cumsum(counts) - counts, counts) \
+        + np.repeat(starts, counts)
+    return source_index, values[value_index]
+
+
+def _join_coordinates(coords, ids, query_coords):
+    """Returns the ID of the row of coords equal to each row of
+       query_coords, or -1 where no row is equal. Rows of coords are
+       assumed to be unique.
+    """
+    coords = np.asarray(coords)
+    query_coords = np.asarray(query_coords)
+    if len(coords) == 0 or len(query_coords) == 0:
+        return np.full(len(query_coords), -1, dtype = np.int64)
+    rows = np.concatenate((coords, query_coords))
+    order = np.lexsort(rows.T[::-1])
+    sorted_rows = rows[order]
+    starts = np.ones(len(rows), dtype = bool)
+    starts[1:] = np.any(sorted_rows[1:] != sorted_rows[:-1], axis = 1)
+    groups = np.empty(len(rows), dtype = np.int64)
+    groups[order] = np.cumsum(starts) - 1
+
+    group_ids = np.full(groups.max() + 1, -1, dtype = np.int64)
+    group_ids[groups[:len(coords)]] = ids
+    return group_ids[groups[len(coords):]]
+
+
 class Projection(object):
     """Projections relate IDs of one domain to IDs of another."""
 
+    # Number of project results kept by Projections using CachedProjection
+    project_cache_size = 16
+
     def __init__(self,source = "undefined", destination = "undefined",
         **kwargs):
         """Construct a Projection between domains source and destination.
@@ -39,6 +159,19 @@ class Projection(object):
             raise ValueError("A projection can only be initialized with "
                 + "names or SubDomains")
 
+        self.project_cache = LRUCache(self.project_cache_size)
+
+
+    def idMap(self, subdomain):
+        """Returns the IdMap the run of this Projection keeps for the given
+           subdomain, or None if the Projection has no run or the run has
+           no map yet.
+        """
+        run = getattr(self, 'run', None)
+        if run is None:
+            return None
+        return run.getIdMap(subdomain)
+
 
     def relates(self,source,destination):
         """Returns True if this Projection is between the two given
@@ -55,6 +188,35 @@ class Projection(object):
         """
         raise NotImplementedError("Cannot perform projection.")
 
+    def project_pairs(self, subdomain, destination):
+        """Projects all IDs in subdomain (a SubDomain or array of IDs) into
+           the given destination at once, keeping track of which source
+           ID produced which destination ID.
+
+           Returns two parallel arrays:
+
+           source_index
+               Index into subdomain of the source ID of each pair, sorted.
+
+           destination_ids
+               The destination ID of each pair.
+
+           Override this to avoid projecting one ID at a time.
+        """
+        if destination == self.destination:
+            source = self.source
+        else:
+            source = self.destination
+
+        source_index = list()
+        destination_ids = list()
+        for i, domain_id in enumerate(subdomain):
+            projected = self.project(SubDomain.instantiate(source,
+                [domain_id]), destination)
+            source_index.extend([i] * len(projected))
+            destination_ids.extend(projected)
+        return _unique_pairs(source_index, destination_ids)
+
 #  def make_projection_dict(self, subdomain, destination):
 #    """Makes a dict from each domain_id in the subdomain.
 #       Override to make this less slow.
@@ -69,16 +231,17 @@ class Projection(object):
 #    return projection_dict
 
     def source_ids(self):
-        """Returns all of the ids associated with the source subdomain.
-           If unable to calculate these ids, return None.
+        """Returns an array of all of the ids associated with the source
+           subdomain. If unable to calculate these ids, return None.
 
            This is for making tables out of the subdomain.
         """
         return None
 
     def destination_ids(self):
-        """Returns all of the ids associated with the destination subdomain.
-           If unable to calculate these ids, return None.
+        """Returns an array of all of the ids associated with the
+           destination subdomain. If unable to calculate these ids, return
+           None.
 
            This is for making tables out of the subdomain.
         """
@@ -120,6 +283,11 @@ class IdentityProjection(Projection):
         result = SubDomain.instantiate(destination,subdomain)
         return result
 
+    def project_pairs(self, subdomain, destination):
+        """Pairs every ID in subdomain with itself."""
+        ids = np.asarray(subdomain)
+        return np.arange(len(ids)), ids
+
 
 @InputFileKey("composition")
 class CompositionProjection(Projection):
@@ -164,13 +332,36 @@ class CompositionProjection(Projection):
 
         return sub
 
+    def project_pairs(self, subdomain, destination):
+        """Chains the project_pairs of each Projection in the composition,
+           joining the pairs of each step on the intermediate IDs.
+        """
+        if destination == self.destination:
+            steps = [(proj, dest) for proj, src, dest
+                in self._projection_list]
+        else:
+            steps = [(proj, src) for proj, src, dest
+                in reversed(self._projection_list)]
+
+        ids = np.asarray(subdomain)
+        source_index = np.arange(len(ids))
+        for proj, dest in steps:
+            # Project each distinct intermediate ID only once
+            intermediate, inverse = np.unique(ids, return_inverse = True)
+            step_index, step_ids = proj.project_pairs(intermediate, dest)
+            adjacency = _build_adjacency(step_index, step_ids)
+            pair_index, ids = _expand_adjacency(adjacency, inverse)
+            source_index, ids = _unique_pairs(source_index[pair_index], ids)
+
+        return source_index, ids
+
     def source_ids(self):
-        """Return a list of all known IDs from the source SubDomain."""
-        return self._projection_list[0].source_ids()
+        """Return an array of all known IDs from the source SubDomain."""
+        return self._projection_list[0][0].source_ids()
 
     def destination_ids(self):
-        """Return a list of all known IDs from the destination Subdomain."""
-        return self._projection_list[-1].destination_ids()
+        """Return an array of all known IDs from the destination Subdomain."""
+        return self._projection_list[-1][0].destination_ids()
 
 
 @InputFileKey("file")
@@ -191,6 +382,11 @@ class TableProjection(Projection):
 
            destination_key
                The column name of the destination IDs in the table
+
+           Optional keyword argument:
+
+           run
+               RunItem whose IdMaps place the IDs of the projection
         """
         super(TableProjection, self).__init__(source, destination, **kwargs)
 
@@ -203,55 +399,43 @@ class TableProjection(Projection):
             self._source_key = kwargs["source_key"]
             self._destination_key = kwargs["destination_key"]
 
-            self._source_dict = dict()
-            self._destination_dict = dict()
-            key_lists = self._table.attributes_by_identifiers(
-                self._table.identifiers(),
-                [self._source_key, self._destination_key],
-                unique = False)
-            for source, destination in zip(*key_lists):
-                if source in self._source_dict:
-                    self._source_dict[source].append(destination)
-                else:
-                    self._source_dict[source] = [destination]
-
-                if destination in self._destination_dict:
-                    self._destination_dict[destination].append(source)
-                else:
-                    self._destination_dict[destination] = [source]
-
-
-  #def make_projection_dict(self, subdomain, destination):
-  #    if destination == self.destination:
-          #return self._source_dict
-  #        return { key : val for key, val in self._source_dict.iteritems()
-  #            if key in subdomain }
-  #    else:
-          #return self._destination_dict
-  #        return { key : val for key, val in self._destination_dict.iteritems()
-  #            if key in subdomain }
+            self.run = kwargs.get("run")
+            self._adjacency = dict() # built by project_pairs
 
 
     def project(self, subdomain, destination):
         """Convert the IDs in subdomain into a SubDomain of type destination.
+           The pairs this is derived from are cached by project_pairs.
         """
-        keys = list()
-        if destination == self.destination:
-            for domain_id in subdomain:
-                keys.extend(self._source_dict[domain_id])
-        else:
-            for domain_id in subdomain:
-                keys.extend(self._destination_dict[domain_id])
+        source_index, keys = self.project_pairs(subdomain, destination)
+        return SubDomain.instantiate(destination, np.unique(keys).tolist())
+
+    @CachedProjection
+    def project_pairs(self, subdomain, destination):
+        """Projects all IDs in subdomain at once through an adjacency built
+           from the key columns of the table.
+        """
+        if destination not in self._adjacency:
+            key_lists = self._table.attributes_by_identifiers(
+                self._table.identifiers(),
+                [self._source_key, self._destination_key],
+                unique = False)
+            if destination == self.destination:
+                self._adjacency[destination] = _build_adjacency(
+                    key_lists[0], key_lists[1], self.idMap(self.source))
+            else:
+                self._adjacency[destination] = _build_adjacency(
+                    key_lists[1], key_lists[0], self.idMap(self.destination))
 
-        return SubDomain.instantiate(destination, list(set(keys)))
+        return _expand_adjacency(self._adjacency[destination], subdomain)
 
     def source_ids(self):
-        """Return a list of all known IDs from the source SubDomain."""
-        return [x for x in self._source_dict]
+        """Return an array of all known IDs from the source SubDomain."""
+        return np.unique(self._table._data[self._source_key])
 
     def destination_ids(self):
-        """Return a list of all known IDs from the destination Subdomain."""
-        return [x for x in self._destination_dict]
+        """Return an array of all known IDs from the destination Subdomain."""
+        return np.unique(self._table._data[self._destination_key])
 
 
 
@@ -334,31 +518,22 @@ class NodeLinkProjection(Projection):
                 for coord in self.coords]
 
 
-            # Nodes and Links are a join on coordinates. We're going to
-            # make coordinate dictionaries so we can use them later
-            # to build node-link dictionaries based on coords and policies
-            self.node_coord_dict = dict()
-            self.coord_node_dict = dict()
-            self.link_coord_dict_source = dict()
-            self.link_coord_dict_destination = dict()
-            self.coord_link_dict_source = dict()
-            self.coord_link_dict_destination = dict()
+            # Nodes and Links are a join on coordinates. We keep the
+            # coordinates as arrays parallel to the IDs so the node-link
+            # pairs can be joined on them for any policy.
             # We can use a group by here because we know there is one
             # node per coordinate
             node_coords, node_ids \
                 = self.source_table._table.group_attributes_by_attributes(
                 self.source_table._table.identifiers(), self.coords,
                 [self.source_table['field']], 'mean')
-            for node_coord, node_id in zip(node_coords, node_ids[0]):
-                self.node_coord_dict[int(node_id)] = node_coord
-                self.coord_node_dict[node_coord] = int(node_id)
+            self.node_ids = np.array(node_ids[0], dtype = np.int64)
+            self.node_coords = np.array(node_coords).reshape(
+                len(self.node_ids), len(self.coords))
 
             # For links, we also do a group-by, but on both the source
             # and destination coordinates
             coord_len = len(self.coords)
-            source_index = coord_len
-            destination_index = source_index + coord_len
-            #link_coord_names = [self.destination_table['field']]
             link_coord_names = list()
             link_coord_names.extend(self.source_coords)
             link_coord_names.extend(self.destination_coords)
@@ -366,91 +541,213 @@ class NodeLinkProjection(Projection):
                 = self.destination_table._table.group_attributes_by_attributes(
                 self.destination_table._table.identifiers(),
                 link_coord_names, [self.destination_table['field']], 'mean')
-            for link_id, link_tuple in zip(link_ids[0], link_coords):
-                link_id = int(link_id)
-                source = link_tuple[0:source_index]
-                destination = link_tuple[source_index:destination_index]
-                if link_id not in self.link_coord_dict_source:
-                    self.link_coord_dict_source[link_id] = source
-                if link_id not in self.link_coord_dict_destination:
-                    self.link_coord_dict_destination[link_id] = destination
-
-                if source not in self.coord_link_dict_source:
-                    self.coord_link_dict_source[source] = [link_id]
-                elif link_id not in self.coord_link_dict_source[source]:
-                    self.coord_link_dict_source[source].append(link_id)
-                if destination not in self.coord_link_dict_destination:
-                    self.coord_link_dict_destination[destination] = [link_id]
-                elif link_id \
-                    not in self.coord_link_dict_destination[destination]:
-                    self.coord_link_dict_destination[destination].append(
-                        link_id)
-
-
-            self.make_dicts()
-
-
-    def make_dicts(self):
-        """Creates dicts that map node IDs to lists of link IDs and vice
-           versa. These are created based on node_policy and link_policy
-           and used to peform the projections.
-        """
-        self.node_dict = dict()
-        self.link_dict = dict()
-        for node_id in self.node_coord_dict:
-            link_list = list()
-            if self.node_policy == 'Source' or self.node_policy == 'Both':
-                link_list.extend(self.coord_link_dict_source[
-                    self.node_coord_dict[node_id]])
-            if self.node_policy == 'Destination' or self.node_policy == 'Both':
-                link_list.extend(self.coord_link_dict_destination[
-                    self.node_coord_dict[node_id]])
-
-            for link_id in link_list:
-                if link_id not in self.link_dict:
-                    self.link_dict[link_id] = [node_id]
-                elif node_id not in self.link_dict[link_id]:
-                    self.link_dict[link_id].append(node_id)
+            self.link_ids = np.array(link_ids[0], dtype = np.int64)
+            link_coords = np.array(link_coords).reshape(
+                len(self.link_ids), 2 * coord_len)
+            self.link_source_coords = link_coords[:, :coord_len]
+            self.link_destination_coords = link_coords[:, coord_len:]
 
-            self.node_dict[node_id] = link_list
+            self.make_pairs()
 
 
-#    def make_projection_dict(self, subdomain, destination):
-#        if destination == self.destination:
-#            return { key : val for key, val in self.node_dict.iteritems()
-#                if key in subdomain }
-#        else:
-#            return { key : val for key, val in self.link_dict.iteritems()
-#                if key in subdomain }
+    def make_pairs(self):
+        """Joins nodes and links on their coordinates to create the
+           (node ID, link ID) pairs of the projection. These are created
+           based on node_policy and used to perform the projections in
+           both directions.
+        """
+        self._adjacency = dict() # built by project_pairs
+        link_ends = list()
+        if self.node_policy == 'Source' or self.node_policy == 'Both':
+            link_ends.append(self.link_source_coords)
+        if self.node_policy == 'Destination' or self.node_policy == 'Both':
+            link_ends.append(self.link_destination_coords)
+
+        node_list = list()
+        link_list = list()
+        for end_coords in link_ends:
+            end_nodes = _join_coordinates(self.node_coords, self.node_ids,
+                end_coords)
+            joined = end_nodes >= 0
+            node_list.append(end_nodes[joined])
+            link_list.append(self.link_ids[joined])
+
+        if node_list:
+            self.node_pairs, self.link_pairs = _unique_pairs(
+                np.concatenate(node_list), np.concatenate(link_list))
+        else:
+            self.node_pairs = np.zeros(0, dtype = np.int64)
+            self.link_pairs = np.zeros(0, dtype = np.int64)
 
 
     def project(self, subdomain, destination):
         """Convert the IDs in subdomain into a SubDomain of type destination.
+           The pairs this is derived from are cached by project_pairs.
         """
-        keys = list()
-        if destination == self.destination: # Nodes -> Links
-            for node_id in subdomain:
-                keys.extend(self.node_dict[node_id])
-        else:
-            for link_id in subdomain:
-                keys.extend(self.link_dict[link_id])
+        source_index, keys = self.project_pairs(subdomain, destination)
+        return SubDomain.instantiate(destination, np.unique(keys).tolist())
 
-        return SubDomain.instantiate(destination, list(set(keys)))
+    @CachedProjection
+    def project_pairs(self, subdomain, destination):
+        """Projects all IDs in subdomain at once through an adjacency built
+           from the node-link pairs.
+        """
+        if destination not in self._adjacency:
+            if destination == self.destination: # Nodes -> Links
+                self._adjacency[destination] = _build_adjacency(
+                    self.node_pairs, self.link_pairs, self.idMap(self.source))
+            else:
+                self._adjacency[destination] = _build_adjacency(
+                    self.link_pairs, self.node_pairs,
+                    self.idMap(self.destination))
+
+        return _expand_adjacency(self._adjacency[destination], subdomain)
 
 
     def update_policies(self, node_policy, link_policy):
         """Changes the node and link policies to the ones given and re-makes
-           the projection dicts accordingly.
+           the projection pairs accordingly.
         """
         self.node_policy = node_policy
         self.link_policy = link_policy
+        self.project_cache.clear()
+
+        self.make_pairs()
+
+    def source_ids(self):
+        """Return an array of all known IDs from the source SubDomain."""
+        return np.unique(self.node_ids)
+
+    def destination_ids(self):
+        """Return an array of all known IDs from the destination Subdomain."""
+        return np.unique(self.link_pairs)
+
+
+@InputFileKey("torus")
+class TorusProjection(Projection):
+    """Node-Link mappings for torus networks computed arithmetically from
+       the torus dimensions rather than from coordinate tables.
+
+       Node IDs are linear in the coordinates with the first coordinate
+       varying fastest. Each node owns two links per dimension, so a
+       link ID is node * 2D + axis * 2 + direction, where direction 0
+       leads to the neighbor at coordinate + 1 and direction 1 leads to
+       the neighbor at coordinate - 1 (both modulo the dimension size).
+
+       The policies are interpreted as in NodeLinkProjection.
+    """
+    def __init__(self, source = "undefined", destination = "undefined",
+        **kwargs):
+        """Construct a TorusProjection.
+
+           Required keyword arguments:
+
+           run
+                RunItem governing this projection. Its hardware
+                meta-information must define 'coords' and 'dim'.
+
+           node_policy
+                How nodes map onto links
+
+           link_policy
+                How links map onto nodes
+
+            Policies: 'Source', 'Destination', and 'Both' as in
+            NodeLinkProjection.
+        """
+        super(TorusProjection, self).__init__(Nodes(), Links(), **kwargs)
+
+        if kwargs:
+            if 'run' not in kwargs or 'node_policy' not in kwargs\
+                or 'link_policy' not in kwargs:
+                raise ValueError("TorusProjection constructor requires "
+                + "run, node_policy, and link_policy.")
+
+            self.run = kwargs['run']
+            self.node_policy = kwargs['node_policy']
+            self.link_policy = kwargs['link_policy']
+
+            hardware_info = self.run["hardware"]
+            if 'coords' not in hardware_info or 'dim' not in hardware_info:
+                raise ValueError("TorusProjection requires hardware coords "
+                    + "and dim in the run meta-information.")
+
+            self.coords = hardware_info["coords"]
+            self.dims = np.array([int(hardware_info["dim"][coord])
+                for coord in self.coords], dtype = np.int64)
+            self.strides = np.ones(len(self.dims), dtype = np.int64)
+            self.strides[1:] = np.cumprod(self.dims[:-1])
+            self.num_nodes = int(np.prod(self.dims))
+            self.links_per_node = 2 * len(self.dims)
+
+
+    def neighbors(self, node_ids, axis, step):
+        """Returns the IDs of the nodes step hops away from node_ids
+           along the given axis, wrapping around the torus.
+        """
+        coord = (node_ids // self.strides[axis]) % self.dims[axis]
+        return node_ids + ((coord + step) % self.dims[axis] - coord) \
+            * self.strides[axis]
+
 
-        self.makedicts()
+    def project(self, subdomain, destination):
+        """Convert the IDs in subdomain into a SubDomain of type destination.
+           The pairs this is derived from are cached by project_pairs.
+        """
+        source_index, keys = self.project_pairs(subdomain, destination)
+        return SubDomain.instantiate(destination,
+            [int(x) for x in np.unique(keys)])
+
+
+    @CachedProjection
+    def project_pairs(self, subdomain, destination):
+        """Projects all IDs in subdomain at once by computing the neighbor
+           IDs of each of them.
+        """
+        ids = np.asarray(subdomain, dtype = np.int64)
+        columns = list()
+        if destination == self.destination: # Nodes -> Links
+            if self.node_policy == 'Source' or self.node_policy == 'Both':
+                for link in range(self.links_per_node):
+                    columns.append(ids * self.links_per_node + link)
+            if self.node_policy == 'Destination' or self.node_policy == 'Both':
+                for axis in range(len(self.dims)):
+                    # Links arriving from the - neighbor travel in the +
+                    # direction and vice versa
+                    columns.append(self.neighbors(ids, axis, -1)
+                        * self.links_per_node + axis * 2)
+                    columns.append(self.neighbors(ids, axis, 1)
+                        * self.links_per_node + axis * 2 + 1)
+        else: # Links -> Nodes
+            source_nodes = ids // self.links_per_node
+            if self.link_policy == 'Source' or self.link_policy == 'Both':
+                columns.append(source_nodes)
+            if self.link_policy == 'Destination' or self.link_policy == 'Both':
+                axes = (ids % self.links_per_node) // 2
+                steps = 1 - 2 * (ids % 2)
+                coords = (source_nodes // self.strides[axes]) % self.dims[axes]
+                columns.append(source_nodes
+                    + ((coords + steps) % self.dims[axes] - coords)
+                    * self.strides[axes])
+
+        if not columns:
+            return np.zeros(0, dtype = np.int64), ids[:0]
+        # One row per source ID, one column per neighbor
+        pairs = np.column_stack(columns)
+        return _unique_pairs(np.repeat(np.arange(len(ids)), len(columns)),
+            pairs.ravel())
+
+
+    def update_policies(self, node_policy, link_policy):
+        """Changes the node and link policies to the ones given."""
+        self.node_policy = node_policy
+        self.link_policy = link_policy
+        self.project_cache.clear()
 
     def source_ids(self):
-        """Return a list of all known IDs from the source SubDomain."""
-        return [x for x in self.node_dict]
+        """Return an array of all known IDs from the source SubDomain."""
+        return np.arange(self.num_nodes)
 
     def destination_ids(self):
-        """Return a list of all known IDs from the destination Subdomain."""
-        return [x for x in self.link_dict]
+        """Return an array of all known IDs from the destination Subdomain."""
+        return np.arange(self.num_nodes * self.links_per_node)
@@ -4,6 +4,7 @@ from PySide.QtCore import Slot,Signal,QObject
 from PySide.QtGui import QWidget,QVBoxLayout,QHBoxLayout,\
 QCheckBox,QSpacerItem,QLineEdit,QLabel
 import sys
+import numpy as np
 
 class Scene(QObject):
     """Parent class for all Scene classes."""
@@ -53,7 +54,8 @@ class HighlightScene(Scene):
 
 class HighlightSet(object):
     """This class holds information regarding a single SubDomain of
-       highlights.
+       highlights. The ids are kept as a sorted, read-only numpy array
+       which copies share until they are given new highlights.
     """
 
     def __init__(self, highlights, run):
@@ -70,9 +72,46 @@ class HighlightSet(object):
         self.highlights = highlights # Subdomain
         self.run = run # RunItem
 
+    @property
+    def highlights(self):
+        """The highlighted ids as a SubDomain."""
+        if self._highlights is None:
+            self._highlights = self._subdomain_type(self.ids.tolist())
+        return self._highlights
+
+    @highlights.setter
+    def highlights(self, highlights):
+        self._subdomain_type = highlights.__class__
+        self._highlights = None
+        ids = np.unique(np.asarray(highlights))
+        if len(ids) == 0:
+            ids = ids.astype(np.int64)
+        ids.flags.writeable = False
+        self.ids = ids
+
+    def subdomain(self):
+        """Returns the subdomain of the highlighted ids."""
+        return self._subdomain_type.subdomain()
+
+    def contains(self, ids):
+        """Returns a boolean array which is True where the given ids
+           are highlighted.
+        """
+        ids = np.asarray(ids)
+        if len(self.ids) == 0:
+            return np.zeros(ids.shape, dtype = bool)
+        positions = np.searchsorted(self.ids, ids)
+        positions[positions >= len(self.ids)] = 0
+        return self.ids[positions] == ids
+
     def copy(self):
-        """Creates a copy of this HighlightSet."""
-        return HighlightSet(self.highlights[:], self.run)
+        """Creates a copy of this HighlightSet sharing its ids."""
+        highlight_set = HighlightSet.__new__(HighlightSet)
+        highlight_set._subdomain_type = self._subdomain_type
+        highlight_set._highlights = None
+        highlight_set.ids = self.ids
+        highlight_set.run = self.run
+        return highlight_set
 
 
 
@@ -12,6 +12,7 @@ and Josh Levine.
 import math
 import numpy as np
 from exceptions import *
+from matplotlib.path import Path
 
 from PySide.QtCore import *
 from PySide.QtGui import *
@@ -38,6 +39,16 @@ def setupPaintEvent(self):
     for text in self.textdraws:
         painter.drawText(text.x, text.y, text.text)
 
+    # Outline of a selection being dragged out with the mouse
+    if self.pick_points is not None and len(self.pick_points) > 1:
+        painter.setPen(QPen(Qt.gray, 1, Qt.DashLine))
+        if self.pick_lasso:
+            painter.drawPolygon(QPolygon([QPoint(x, y)
+                for x, y in self.pick_points]))
+        else:
+            painter.drawRect(QRect(QPoint(*self.pick_points[0]),
+                QPoint(*self.pick_points[-1])))
+
     painter.end()
 
 
@@ -47,7 +58,16 @@ class GLWidget(QGLWidget):
         Other than handling mouse events for basic interactive features, this
         is just a regular QGLWidget, so the user still needs to implement
         resizeGL(), initializeGL(), and paintGL() to get their scene drawn.
+
+        Subclasses that set pick_enabled can have items picked with the
+        right mouse button: a click picks the front item under the cursor,
+        a drag picks everything visible in a rectangle and a drag with
+        control held picks everything visible in a lasso. They implement
+        pickDraw() and pickSelect(), and may implement pickIndex() to have
+        clicks picked against the bounding boxes of the items instead of
+        drawing them.
     """
+    pick_enabled = False
 
     transformChangeSignal = Signal(np.ndarray, np.ndarray)
     resizeSignal = Signal()
@@ -94,6 +114,12 @@ class GLWidget(QGLWidget):
 
         self.textdraws = []
 
+        # Mouse path of a right button selection and offscreen buffer
+        # for the picking pass
+        self.pick_points = None
+        self.pick_lasso = False
+        self.pick_fbo = None
+
     def set_translation(self, t):
         """Ensure that translation is always a numpy array."""
         if type(t) == np.ndarray and t.dtype == float:
@@ -226,17 +252,33 @@ class GLWidget(QGLWidget):
         self.last_pos = self.map_to_sphere(x, y)
         self.dragging = True
 
+        if self.pick_enabled and event.button() == Qt.RightButton:
+            self.pick_points = [(x, y)]
+            self.pick_lasso = bool(event.modifiers() & Qt.ControlModifier)
+
     def mouseReleaseEvent(self, event):
         """Ends dragging so that mouseMoveEvent() will know not to adjust
-           things.
+           things. Finishes any selection made with the right button.
         """
         self.dragging = False
 
+        if self.pick_points is not None \
+            and event.button() == Qt.RightButton:
+            points = self.pick_points
+            self.pick_points = None
+            self.pickSelect(self.pickRegion(points, self.pick_lasso))
+            self.paintEvent(None)
+
     def mouseMoveEvent(self, event):
         """This method rotates the scene around as the mouse moves, and it
            calls updateGL() to notify the UI that the system needs updating.
            Rotation is quaternion (axis/angle) based.
         """
+        if self.pick_points is not None:
+            self.pick_points.append((event.x(), event.y()))
+            self.paintEvent(event)
+            return
+
         if not self.dragging:
             return
 
@@ -312,6 +354,122 @@ class GLWidget(QGLWidget):
         """To be implemented by subclasses"""
         pass
 
+    def pickDraw(self):
+        """To be implemented by subclasses that set pick_enabled. Draws
+           every pickable item, unlit, in the color given to its index by
+           pickColors.
+        """
+        pass
+
+    def pickSelect(self, indices):
+        """To be implemented by subclasses that set pick_enabled. Handles
+           the sorted array of item indices picked with the mouse.
+        """
+        pass
+
+    def pickIndex(self):
+        """May be implemented by subclasses that set pick_enabled. Returns
+           a BoxIndex of the pickable items, which is used for clicks in
+           place of drawing pickDraw(), or None.
+        """
+        return None
+
+    def pickRay(self, x, y):
+        """Returns the origin and direction, in the coordinates set up by
+           orient_scene(), of the ray through the center of the pixel at
+           the given window position. The ray starts on the near plane of
+           the perspective used for picking.
+        """
+        height = max(self.height(), 1)
+        half_height = math.tan(self.fov / 360.0 * math.pi)
+        half_width = half_height * self.width() / float(height)
+        eye = np.array([(2.0 * (x + 0.5) / self.width() - 1) * half_width,
+            (1 - 2.0 * (y + 0.5) / height) * half_height, -1.0])
+
+        # orient_scene() maps p to R p + t, where R is the transpose of
+        # self.rotation since glMultMatrixd reads it in column-major order
+        inverse = self.rotation[:3, :3]
+        return inverse.dot(eye * self.near_plane - self.translation), \
+            inverse.dot(eye)
+
+    def pickRegion(self, points, lasso = False):
+        """Returns the sorted indices of the items visible along a mouse
+           path in window coordinates. A path that barely moves picks the
+           front item under its first point, using pickIndex() when there
+           is one. Otherwise the items in the bounding rectangle of the
+           path, or in the lasso it outlines, are picked.
+        """
+        points = np.array(points, dtype = np.int64)
+        low = np.clip(points.min(axis = 0), 0, [self.width() - 1,
+            self.height() - 1])
+        high = np.clip(points.max(axis = 0), 0, [self.width() - 1,
+            self.height() - 1])
+        if (high - low).max() < 3:
+            low = high = np.clip(points[0], 0, [self.width() - 1,
+                self.height() - 1])
+            lasso = False
+
+            index = self.pickIndex()
+            if index is not None:
+                nearest = index.nearest(*self.pickRay(*low))
+                return np.array([nearest] if nearest >= 0 else [],
+                    dtype = np.int64)
+
+        indices = self.renderPickIndices(low[0], low[1],
+            high[0] - low[0] + 1, high[1] - low[1] + 1)
+        if lasso and len(points) > 2:
+            ys, xs = np.mgrid[low[1]:high[1] + 1, low[0]:high[0] + 1]
+            inside = Path(points).contains_points(
+                np.column_stack([xs.ravel(), ys.ravel()]))
+            indices = indices.ravel()[inside]
+
+        return np.unique(indices[indices >= 0])
+
+    def renderPickIndices(self, x, y, width, height):
+        """Draws pickDraw() into an offscreen framebuffer and returns the
+           index picked at each pixel of the given window rectangle, as a
+           height x width array with -1 where nothing was drawn.
+        """
+        self.makeCurrent()
+        use_fbo = QGLFramebufferObject.hasOpenGLFramebufferObjects()
+        if use_fbo:
+            if self.pick_fbo is None or self.pick_fbo.size() != self.size():
+                self.pick_fbo = QGLFramebufferObject(self.width(),
+                    self.height(), QGLFramebufferObject.Depth)
+            self.pick_fbo.bind()
+
+        glPushAttrib(GL_ALL_ATTRIB_BITS)
+        glViewport(0, 0, self.width(), self.height())
+        glClearColor(0, 0, 0, 0)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        for bit in [GL_LIGHTING, GL_BLEND, GL_DITHER, GL_MULTISAMPLE,
+            GL_LINE_SMOOTH, GL_POLYGON_SMOOTH, GL_TEXTURE_2D]:
+            glDisable(bit)
+        glEnable(GL_DEPTH_TEST)
+
+        with glModeMatrix(GL_PROJECTION):
+            glLoadIdentity()
+            set_perspective(self.fov, self.width() / float(self.height()),
+                self.near_plane, self.far_plane)
+            glMatrixMode(GL_MODELVIEW)
+            with glMatrix():
+                self.orient_scene()
+                self.pickDraw()
+
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        pixels = glReadPixels(x, self.height() - y - height, width, height,
+            GL_RGBA, GL_UNSIGNED_BYTE)
+        glPopAttrib()
+        if use_fbo:
+            self.pick_fbo.release()
+
+        if isinstance(pixels, str):
+            pixels = np.fromstring(pixels, dtype = np.uint8)
+        pixels = np.asarray(pixels, dtype = np.uint8).reshape(height, width, 4)
+
+        # Rows are read bottom up
+        return pickIndices(pixels[::-1])
+
     def orient_scene(self):
         """You should call this from paintGL() to orient the scene before
            rendering. This will do translation and rotation so that rendering
@@ -6,7 +6,10 @@ Author:
     Todd Gamblin, tgamblin@llnl.gov
 """
 from contextlib import contextmanager
+import numpy as np
 from OpenGL.GL import *
+from OpenGL.GL import shaders
+from OpenGL.error import GLError
 #from glefix import *
 
 @contextmanager
@@ -53,6 +56,14 @@ def disabled(*glBits):
     for bit in glBits:
         glEnable(bit)
 
+@contextmanager
+def clientStates(*glArrays):
+    for array in glArrays:
+        glEnableClientState(array)
+    yield
+    for array in glArrays:
+        glDisableClientState(array)
+
 @contextmanager
 def overlays2D(width, height, background_color):
     """The before and after gl calls necessary to setup 2D overlays to the
@@ -252,6 +263,73 @@ def notGlutSolidCube(size):
         glVertex(n, p, n)
 
 
+def solidCubeQuads(size):
+    """Returns the vertices and normals of the GL_QUADS drawn by
+       notGlutSolidCube, as two 24 x 3 arrays.
+    """
+    p = size / 2
+    n = -1 * p
+    vertices = np.array([
+        [n, p, n], [n, n, n], [p, n, n], [p, p, n],   # front
+        [n, p, p], [n, p, n], [p, p, n], [p, p, p],   # top
+        [p, p, n], [p, n, n], [p, n, p], [p, p, p],   # right
+        [p, p, p], [p, n, p], [n, n, p], [n, p, p],   # back
+        [p, n, p], [p, n, n], [n, n, n], [n, n, p],   # bottom
+        [n, p, p], [n, n, p], [n, n, n], [n, p, n]],  # left
+        dtype = np.float32)
+    normals = np.repeat(np.array([[0, 0, 1.], [0, 1., 0], [1., 0, 0],
+        [0, 0, -1.], [0, -1., 0], [-1., 0, 0]], dtype = np.float32), 4,
+        axis = 0)
+    return vertices, normals
+
+def polyCylinderQuads(start, end, axis, radius):
+    """Returns the vertices and normals of the cylinder drawn by
+       notGlePolyCylinder between start and end along the given axis, as
+       two 40 x 3 arrays of GL_QUADS.
+    """
+    c0, c1, c2, c3 = cyltrigs
+    ring = np.array([(0, 1.), (c0, c1), (c2, c3), (c2, -c3), (c0, -c1),
+        (0, -1.), (-c0, -c1), (-c2, -c3), (-c2, c3), (-c0, c1), (0, 1.)])
+
+    # The ring lies in the two other axes, in increasing order
+    strip_normals = np.zeros((len(ring), 3))
+    strip_normals[:, [dim for dim in range(3) if dim != axis]] = ring
+
+    # Quad strip vertex pairs at the start and end of the cylinder
+    strip = np.repeat(strip_normals * radius, 2, axis = 0)
+    strip[0::2, axis] = start
+    strip[1::2, axis] = end
+    strip_normals = np.repeat(strip_normals, 2, axis = 0)
+
+    # Quad i of the strip is made of strip vertices 2i, 2i+1, 2i+3, 2i+2
+    quads = (2 * np.arange(len(ring) - 1)[:, np.newaxis]
+        + np.array([0, 1, 3, 2])).flatten()
+    return strip[quads].astype(np.float32), \
+        strip_normals[quads].astype(np.float32)
+
+
+def pickColors(indices):
+    """Returns an array of opaque RGBA colors encoding the given indices,
+       for drawing items in a color-ID picking pass. Up to 2^24 - 1
+       indices can be encoded; black is left for the background.
+    """
+    codes = np.asarray(indices, dtype = np.int64).reshape(-1) + 1
+    colors = np.ones((len(codes), 4), dtype = np.float32)
+    colors[:, 0] = codes & 255
+    colors[:, 1] = (codes >> 8) & 255
+    colors[:, 2] = (codes >> 16) & 255
+    colors[:, :3] /= 255.0
+    return colors
+
+def pickIndices(pixels):
+    """Decodes an array of RGBA unsigned byte pixels drawn with
+       pickColors back into indices, with -1 for the background.
+    """
+    pixels = np.asarray(pixels, dtype = np.int64)
+    return (pixels[..., 0] | (pixels[..., 1] << 8)
+        | (pixels[..., 2] << 16)) - 1
+
+
 class DisplayList(object):
     """Use this to turn some rendering function of yours into a DisplayList,
        without all the tedious setup.
@@ -302,3 +380,438 @@ class DisplayList(object):
             self.needsUpdate = False
         else:
             glCallList(self.listId)
+
+
+class VertexBufferList(object):
+    """Use this in place of a DisplayList for large batches of primitives
+       whose geometry rarely changes but whose colors often do.
+
+       The geometry function returns the vertices and normals of all the
+       primitives as two N x 3 arrays. The color function returns one RGBA
+       row per item, where items are runs of equally many vertices (say,
+       the 24 vertices of a cube):
+           myList = VertexBufferList(myGeometryFunction, myColorFunction)
+           myList()
+
+       The geometry is kept in static buffer objects and is only
+       regenerated after a call to updateGeometry(). A call to update()
+       only fetches the colors again, which are written over the existing
+       color buffer with glBufferSubData.
+    """
+    def __init__(self, geometryFunction, colorFunction, mode = GL_QUADS):
+        self.geometryFunction = geometryFunction
+        self.colorFunction = colorFunction
+        self.mode = mode
+        self.needsGeometry = True
+        self.needsColors = True
+        self.bufferIds = None
+        self.num_vertices = 0
+
+    def update(self):
+        self.needsColors = True
+
+    def updateGeometry(self):
+        self.needsGeometry = True
+        self.needsColors = True
+
+    def colorArray(self):
+        """Returns the per-vertex colors as a float32 array."""
+        colors = np.asarray(self.colorFunction(), dtype = np.float32)
+        colors = colors.reshape(-1, 4)
+        if len(colors) == 0:
+            return np.zeros((self.num_vertices, 4), dtype = np.float32)
+        return np.repeat(colors, self.num_vertices // len(colors), axis = 0)
+
+    def __call__(self):
+        if self.bufferIds is None:
+            self.bufferIds = glGenBuffers(3)
+        vertex_buffer, normal_buffer, color_buffer = self.bufferIds
+
+        if self.needsGeometry:
+            vertices, normals = self.geometryFunction()
+            self.num_vertices = len(vertices)
+            glBindBuffer(GL_ARRAY_BUFFER, vertex_buffer)
+            glBufferData(GL_ARRAY_BUFFER,
+                np.ascontiguousarray(vertices, dtype = np.float32),
+                GL_STATIC_DRAW)
+            glBindBuffer(GL_ARRAY_BUFFER, normal_buffer)
+            glBufferData(GL_ARRAY_BUFFER,
+                np.ascontiguousarray(normals, dtype = np.float32),
+                GL_STATIC_DRAW)
+            glBindBuffer(GL_ARRAY_BUFFER, color_buffer)
+            glBufferData(GL_ARRAY_BUFFER, self.colorArray(), GL_DYNAMIC_DRAW)
+            self.needsGeometry = False
+            self.needsColors = False
+        elif self.needsColors:
+            colors = self.colorArray()
+            glBindBuffer(GL_ARRAY_BUFFER, color_buffer)
+            glBufferSubData(GL_ARRAY_BUFFER, 0, colors.nbytes, colors)
+            self.needsColors = False
+
+        if self.num_vertices == 0:
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+            return
+
+        with clientStates(GL_VERTEX_ARRAY, GL_NORMAL_ARRAY, GL_COLOR_ARRAY):
+            glBindBuffer(GL_ARRAY_BUFFER, vertex_buffer)
+            glVertexPointer(3, GL_FLOAT, 0, None)
+            glBindBuffer(GL_ARRAY_BUFFER, normal_buffer)
+            glNormalPointer(GL_FLOAT, 0, None)
+            glBindBuffer(GL_ARRAY_BUFFER, color_buffer)
+            glColorPointer(4, GL_FLOAT, 0, None)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+            glDrawArrays(self.mode, 0, self.num_vertices)
+
+    def delete(self):
+        """Frees the buffer objects. Must be called with the GL context
+           current.
+        """
+        if self.bufferIds is not None:
+            glDeleteBuffers(3, self.bufferIds)
+            self.bufferIds = None
+        self.updateGeometry()
+
+
+# Shaders for InstancedBufferList, approximating the fixed function
+# lighting set up by GLWidget for material-colored geometry.
+instanced_vertex_shader = """
+#version 120
+attribute vec3 position;
+attribute vec3 normal;
+attribute vec3 offset;
+attribute vec4 color;
+uniform bool lighting;
+varying vec4 lit_color;
+
+void main()
+{
+    vec4 eye = gl_ModelViewMatrix * vec4(position + offset, 1.0);
+    gl_Position = gl_ProjectionMatrix * eye;
+    if (!lighting)
+    {
+        lit_color = color;
+        return;
+    }
+
+    vec4 light = gl_LightSource[0].position;
+    vec3 to_light = normalize(light.xyz - eye.xyz * light.w);
+    float diffuse = abs(dot(normalize(gl_NormalMatrix * normal), to_light));
+    vec3 ambient = gl_LightModel.ambient.rgb + gl_LightSource[0].ambient.rgb;
+    lit_color = vec4(clamp(color.rgb * (ambient
+        + diffuse * gl_LightSource[0].diffuse.rgb), 0.0, 1.0), color.a);
+}
+"""
+
+instanced_fragment_shader = """
+#version 120
+varying vec4 lit_color;
+
+void main()
+{
+    gl_FragColor = lit_color;
+}
+"""
+
+
+class InstancedBufferList(object):
+    """Use this in place of a DisplayList to draw many copies of a few
+       meshes, such as a cube at every node of a torus.
+
+       The mesh function returns a list of meshes, each a pair of N x 3
+       vertex and normal arrays. The instance function returns, for each
+       mesh, a pair of M x 3 offset and M x 4 RGBA color arrays. Every mesh
+       is drawn once at each of its offsets in the matching color:
+           myList = InstancedBufferList(myMeshFunction, myInstanceFunction)
+           myList()
+
+       Meshes are only regenerated after updateGeometry() while update()
+       only fetches the instances again. When the context supports it,
+       each mesh is drawn with a single glDrawArraysInstanced call.
+       Otherwise all of the instances are batched into one
+       VertexBufferList.
+    """
+    attribute_names = ["position", "normal", "offset", "color"]
+
+    def __init__(self, meshFunction, instanceFunction, mode = GL_QUADS):
+        self.meshFunction = meshFunction
+        self.instanceFunction = instanceFunction
+        self.mode = mode
+        self.needsMeshes = True
+        self.needsInstances = True
+
+        self.instanced = None # Decided once there is a context
+        self.program = None
+        self.attributes = dict()
+        self.bufferIds = []
+        self.mesh_arrays = []
+        self.instance_arrays = []
+
+        self.batched = VertexBufferList(self.batchedGeometry,
+            self.batchedColors, mode)
+        self.batched_offsets = None
+
+    def update(self):
+        self.needsInstances = True
+
+    def updateGeometry(self):
+        self.needsMeshes = True
+        self.needsInstances = True
+
+    def fetchArrays(self):
+        """Calls the mesh and instance functions as needed."""
+        if self.needsMeshes:
+            self.mesh_arrays = [(
+                np.asarray(vertices, dtype = np.float32).reshape(-1, 3),
+                np.asarray(normals, dtype = np.float32).reshape(-1, 3))
+                for vertices, normals in self.meshFunction()]
+        if self.needsInstances:
+            self.instance_arrays = [(
+                np.asarray(offsets, dtype = np.float32).reshape(-1, 3),
+                np.asarray(colors, dtype = np.float32).reshape(-1, 4))
+                for offsets, colors in self.instanceFunction()]
+
+    def createProgram(self):
+        """Compiles the instancing shaders, returning False if instanced
+           drawing is not supported in the current context.
+        """
+        if not (bool(glDrawArraysInstanced) and bool(glVertexAttribDivisor)):
+            return False
+        try:
+            self.program = shaders.compileProgram(
+                shaders.compileShader(instanced_vertex_shader,
+                    GL_VERTEX_SHADER),
+                shaders.compileShader(instanced_fragment_shader,
+                    GL_FRAGMENT_SHADER))
+        except (RuntimeError, GLError):
+            return False
+
+        self.attributes = dict((name, glGetAttribLocation(self.program, name))
+            for name in self.attribute_names)
+        self.lighting_location = glGetUniformLocation(self.program, "lighting")
+        return min(self.attributes.values()) >= 0
+
+    def __call__(self):
+        if self.instanced is None:
+            self.instanced = self.createProgram()
+
+        if self.instanced:
+            self.drawInstanced()
+        else:
+            self.drawBatched()
+
+    def drawInstanced(self):
+        """Draws each mesh at all of its instances with one call."""
+        needsMeshes = self.needsMeshes
+        self.fetchArrays()
+
+        if len(self.bufferIds) != len(self.mesh_arrays):
+            self.deleteBuffers()
+            self.bufferIds = [glGenBuffers(4) for mesh in self.mesh_arrays]
+            needsMeshes = True
+
+        for buffers, (vertices, normals), (offsets, colors) in zip(
+            self.bufferIds, self.mesh_arrays, self.instance_arrays):
+            if needsMeshes:
+                glBindBuffer(GL_ARRAY_BUFFER, buffers[0])
+                glBufferData(GL_ARRAY_BUFFER, vertices, GL_STATIC_DRAW)
+                glBindBuffer(GL_ARRAY_BUFFER, buffers[1])
+                glBufferData(GL_ARRAY_BUFFER, normals, GL_STATIC_DRAW)
+            if self.needsInstances:
+                glBindBuffer(GL_ARRAY_BUFFER, buffers[2])
+                glBufferData(GL_ARRAY_BUFFER, offsets, GL_DYNAMIC_DRAW)
+                glBindBuffer(GL_ARRAY_BUFFER, buffers[3])
+                glBufferData(GL_ARRAY_BUFFER, colors, GL_DYNAMIC_DRAW)
+        self.needsMeshes = False
+        self.needsInstances = False
+
+        glUseProgram(self.program)
+        # Like fixed function drawing, only light when lighting is enabled
+        glUniform1i(self.lighting_location, int(glIsEnabled(GL_LIGHTING)))
+        locations = [self.attributes[name] for name in self.attribute_names]
+        for location in locations:
+            glEnableVertexAttribArray(location)
+        glVertexAttribDivisor(self.attributes["offset"], 1)
+        glVertexAttribDivisor(self.attributes["color"], 1)
+
+        for buffers, (vertices, normals), (offsets, colors) in zip(
+            self.bufferIds, self.mesh_arrays, self.instance_arrays):
+            if len(vertices) == 0 or len(offsets) == 0:
+                continue
+            for location, buffer_id, size in zip(locations, buffers,
+                [3, 3, 3, 4]):
+                glBindBuffer(GL_ARRAY_BUFFER, buffer_id)
+                glVertexAttribPointer(location, size, GL_FLOAT, GL_FALSE, 0,
+                    None)
+            glDrawArraysInstanced(self.mode, 0, len(vertices), len(offsets))
+
+        glVertexAttribDivisor(self.attributes["offset"], 0)
+        glVertexAttribDivisor(self.attributes["color"], 0)
+        for location in locations:
+            glDisableVertexAttribArray(location)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glUseProgram(0)
+
+    def drawBatched(self):
+        """Draws all the instances from a single vertex buffer, only
+           regenerating its geometry when the meshes or offsets change.
+        """
+        if self.needsMeshes or self.needsInstances:
+            needsMeshes = self.needsMeshes
+            self.fetchArrays()
+            offsets = [instance_offsets for instance_offsets, colors
+                in self.instance_arrays]
+            if needsMeshes or self.batched_offsets is None \
+                or len(offsets) != len(self.batched_offsets) \
+                or not all(np.array_equal(new, old) for new, old
+                    in zip(offsets, self.batched_offsets)):
+                self.batched.updateGeometry()
+            else:
+                self.batched.update()
+            self.batched_offsets = offsets
+            self.needsMeshes = False
+            self.needsInstances = False
+
+        self.batched()
+
+    def batchedGeometry(self):
+        vertices = []
+        normals = []
+        for (mesh_vertices, mesh_normals), (offsets, colors) in zip(
+            self.mesh_arrays, self.instance_arrays):
+            vertices.append((offsets[:, np.newaxis, :]
+                + mesh_vertices).reshape(-1, 3))
+            normals.append(np.tile(mesh_normals, (len(offsets), 1)))
+        return np.concatenate(vertices), np.concatenate(normals)
+
+    def batchedColors(self):
+        return np.concatenate([np.repeat(colors, len(mesh_vertices), axis = 0)
+            for (mesh_vertices, mesh_normals), (offsets, colors)
+            in zip(self.mesh_arrays, self.instance_arrays)])
+
+    def deleteBuffers(self):
+        for buffers in self.bufferIds:
+            glDeleteBuffers(4, buffers)
+        self.bufferIds = []
+
+    def delete(self):
+        """Frees the buffer objects. Must be called with the GL context
+           current.
+        """
+        self.deleteBuffers()
+        self.batched.delete()
+        self.updateGeometry()
+
+
+def rayBoxDistances(origin, direction, lows, highs):
+    """Returns the distance along the ray from origin in direction, in
+       units of direction, at which it enters each of the axis aligned
+       boxes with the given N x 3 low and high corners, or inf where it
+       misses the box. A ray starting inside a box enters it at 0.
+    """
+    origin = np.asarray(origin, dtype = np.float64)
+    direction = np.asarray(direction, dtype = np.float64)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        near = (lows - origin) / direction
+        far = (highs - origin) / direction
+    entry = np.minimum(near, far)
+    exit = np.maximum(near, far)
+
+    # A ray parallel to an axis is inside that slab everywhere or nowhere
+    parallel = direction == 0
+    if parallel.any():
+        inside = (lows[:, parallel] <= origin[parallel]) \
+            & (origin[parallel] <= highs[:, parallel])
+        entry[:, parallel] = np.where(inside, -np.inf, np.inf)
+        exit[:, parallel] = np.where(inside, np.inf, -np.inf)
+
+    entry = np.maximum(entry.max(axis = 1), 0)
+    return np.where(entry <= exit.min(axis = 1), entry, np.inf)
+
+
+class BoxIndex(object):
+    """Use this to find the items under the mouse without drawing them.
+       The box function returns the index of every item and the N x 3 low
+       and high corners of its axis aligned bounding box, in the
+       coordinates set up by orient_scene():
+           myIndex = BoxIndex(myBoxFunction)
+           index = myIndex.nearest(*myGLWidget.pickRay(x, y))
+
+       Like a DisplayList, the boxes are only fetched again after update().
+       They are bucketed into a uniform grid by their centers so that a
+       ray is only tested against the boxes in the cells it passes
+       through.
+    """
+    def __init__(self, boxFunction, cell_items = 64):
+        self.boxFunction = boxFunction
+        self.cell_items = cell_items # Average number of boxes in a cell
+        self.needsBoxes = True
+
+    def update(self):
+        self.needsBoxes = True
+
+    def build(self):
+        """Fetches the boxes and buckets them into grid cells, keeping the
+           bounds of each cell.
+        """
+        ids, lows, highs = self.boxFunction()
+        self.ids = np.asarray(ids, dtype = np.int64).reshape(-1)
+        self.lows = np.asarray(lows, dtype = np.float64).reshape(-1, 3)
+        self.highs = np.asarray(highs, dtype = np.float64).reshape(-1, 3)
+        self.needsBoxes = False
+
+        count = len(self.ids)
+        if count == 0:
+            self.order = np.zeros(0, dtype = np.intp)
+            self.cell_starts = np.zeros(1, dtype = np.intp)
+            self.cell_lows = self.cell_highs = np.zeros((0, 3))
+            return
+
+        cells_per_axis = max(1,
+            int(np.ceil((count / float(self.cell_items)) ** (1 / 3.0))))
+        centers = (self.lows + self.highs) / 2
+        low, high = centers.min(axis = 0), centers.max(axis = 0)
+        spans = np.where(high > low, high - low, 1)
+        cells = np.minimum(((centers - low) / spans
+            * cells_per_axis).astype(np.intp), cells_per_axis - 1)
+        keys = np.ravel_multi_index(tuple(cells.T), (cells_per_axis,) * 3)
+
+        self.order = np.argsort(keys, kind = 'mergesort')
+        keys = keys[self.order]
+        starts = np.flatnonzero(np.concatenate([[True],
+            keys[1:] != keys[:-1]]))
+        self.cell_starts = np.append(starts, count)
+        self.cell_lows = np.minimum.reduceat(self.lows[self.order], starts)
+        self.cell_highs = np.maximum.reduceat(self.highs[self.order], starts)
+
+    def intersect(self, origin, direction):
+        """Returns the indices of the items whose boxes are hit by the ray
+           from origin in direction, nearest first, and the distances at
+           which the ray enters them.
+        """
+        if self.needsBoxes:
+            self.build()
+
+        hit_cells = np.flatnonzero(np.isfinite(rayBoxDistances(origin,
+            direction, self.cell_lows, self.cell_highs)))
+        if len(hit_cells) == 0:
+            return np.zeros(0, dtype = np.int64), np.zeros(0)
+
+        candidates = np.concatenate([self.order[start:end]
+            for start, end in zip(self.cell_starts[hit_cells],
+                self.cell_starts[hit_cells + 1])])
+        distances = rayBoxDistances(origin, direction,
+            self.lows[candidates], self.highs[candidates])
+        hits = np.isfinite(distances)
+        candidates, distances = candidates[hits], distances[hits]
+
+        nearest = np.lexsort((candidates, distances))
+        return self.ids[candidates[nearest]], distances[nearest]
+
+    def nearest(self, origin, direction):
+        """Returns the index of the nearest item hit by the ray from origin
+           in direction, or -1 if it hits nothing.
+        """
+        indices, distances = self.intersect(origin, direction)
+        if len(indices) == 0:
+            return -1
+        return indices[0]
@@ -71,10 +71,8 @@ class PlotterAgent(ModuleAgent):
             return
 
         domain_indices = self.getHighlightIDs(self.table, self.table.getRun())
-        highlight_indices = []
-        for i, indx in enumerate(self.ids):
-            if indx in domain_indices:
-                highlight_indices.append(i)
+        highlight_indices = np.nonzero(np.in1d(self.ids,
+            domain_indices))[0].tolist()
         self.highlightUpdateSignal.emit(highlight_indices)
 
 @Module("Plotter", PlotterAgent)
@@ -1,7 +1,8 @@
 import sys
+import numpy as np
 from PySide.QtCore import Signal, Slot
 from PySide.QtGui import QTabWidget, QTableWidget, QAbstractItemView, \
-    QItemSelectionModel
+    QItemSelectionModel, QItemSelection
 
 from boxfish.ModuleAgent import *
 from boxfish.ModuleFrame import *
@@ -263,17 +264,18 @@ class TableTab(QTableWidget):
 
         selectionModel = self.selectionModel()
         selectionModel.clearSelection()
-        selection = selectionModel.selection()
 
-        # Check if each row is in the id set and if so add it to the
-        # selection
-        for row in range(self.rowCount()):
-            if self.ids[row] in ids:
-                self.selectRow(row)
-                selection.merge(selectionModel.selection(),
-                    QItemSelectionModel.Select)
+        # Find the rows whose ids are in the id set and select each run
+        # of consecutive rows as one range
+        rows = np.nonzero(np.in1d(self.ids[:self.rowCount()],
+            list(ids)))[0]
+        selection = QItemSelection()
+        last_column = self.columnCount() - 1
+        for row_run in np.split(rows, np.nonzero(np.diff(rows) != 1)[0] + 1):
+            if len(row_run) > 0:
+                selection.select(self.model().index(int(row_run[0]), 0),
+                    self.model().index(int(row_run[-1]), last_column))
 
-        selectionModel.clearSelection()
         selectionModel.select(selection, QItemSelectionModel.Select)
 
 
@@ -6,6 +6,7 @@ from boxfish.gl.glutils import *
 
 import TorusIcons
 from boxfish.ColorMaps import ColorMap, ColorMapWidget, drawGLColorBar
+from boxfish.util.IdMap import IdMap
 
 class Torus3dAgent(GLAgent):
     """This is an agent for all 3D Torus based modules."""
@@ -127,10 +128,14 @@ class Torus3dAgent(GLAgent):
         """When the node-related request is updated, this re-grabs the
            values associated with the node-ids and signals the change.
         """
-        node_ids, values = self.requestOnDomain("nodes",
+        self.requestOnDomainAsync("nodes", self.nodeValuesReceived,
             domain_table = self.coords_table,
             row_aggregator = "mean", attribute_aggregator = "mean")
 
+    def nodeValuesReceived(self, node_ids, values):
+        """Stores the node values requested by updateNodeValues, updates the
+           color range, and signals the change.
+        """
         # Handle if color range has changed
         scene = self.requestScene("nodes")
         if values:
@@ -150,11 +155,14 @@ class Torus3dAgent(GLAgent):
         """When the link-related request is updated, this re-grabs the
            values associated with the link-ids and signals the change.
         """
-        link_ids, values = self.requestOnDomain("links",
+        self.requestOnDomainAsync("links", self.linkValuesReceived,
             domain_table = self.link_coords_table,
             row_aggregator = "mean", attribute_aggregator = "mean")
 
-
+    def linkValuesReceived(self, link_ids, values):
+        """Stores the link values requested by updateLinkValues, updates the
+           color range, and signals the change.
+        """
         scene = self.requestScene("links")
         if values:
             scene.local_max_range = (min(values), max(values))
@@ -257,6 +265,8 @@ class Torus3dFrameDataModel(object):
         self.shape = [0, 0, 0]
         self.has_links = False
         self.link_direction = 0
+        self.node_map = IdMap([])
+        self.node_index = np.zeros(0, dtype = np.intp)
 
     def clearNodes(self):
         # The first is the actual value, the second is a flag
@@ -301,10 +311,32 @@ class Torus3dFrameDataModel(object):
         self.shape = shape
         self.has_links = has_links
 
+        # Flat positions in the block arrays of every node and link id,
+        # so that data updates are whole-array operations
+        self.node_map = IdMap(node_coord.keys())
+        node_coords = np.array([node_coord[node] for node in self.node_map.ids],
+            dtype = np.intp).reshape(-1, 3)
+        self.node_index = np.ravel_multi_index(node_coords.T, self.shape)
+
+        if has_links:
+            self.link_map = IdMap(link_coord.keys())
+            link_coords = np.array([link_coord[link]
+                for link in self.link_map.ids], dtype = np.intp).reshape(-1, 6)
+            x, y, z, axis, direction = self.link_coords_to_indices(link_coords)
+            self.link_index = np.ravel_multi_index((x, y, z, axis),
+                self.shape + (3, ))
+            self.link_direction_index = direction
+
     def _notifyListeners(self):
         for listener in self.listeners:
             listener()
 
+    def nodesAt(self, indices):
+        """Returns a list of the ids of the nodes at the given flat
+           positions in the block arrays.
+        """
+        return self.node_map.ids[np.in1d(self.node_index, indices)].tolist()
+
     def registerListener(self, listener):
         self.listeners.add(listener)
 
@@ -327,6 +359,24 @@ class Torus3dFrameDataModel(object):
         elif diff[axis] == -1 or diff[axis] > 1: # negative direction link
             return tx, ty, tz, axis, -1
 
+    def link_coords_to_indices(self, coords):
+        """Array version of link_coord_to_index. Given an N x 6 array of
+           link coordinates, returns arrays of the x, y, z, axis and
+           direction of each link.
+        """
+        start = coords[:, 0:3]
+        end = coords[:, 3:]
+
+        diff = end - start
+        axis = np.argmax(diff != 0, axis = 1)
+        axis_diff = diff[np.arange(len(coords)), axis]
+
+        # Positive links start at the source, negative ones at the target
+        positive = (axis_diff == 1) | (axis_diff < -1)
+        direction = np.where(positive, 1, -1)
+        x, y, z = np.where(positive[:, np.newaxis], start, end).T
+        return x, y, z, axis, direction
+
     @Slot(list, list)
     def updateNodeData(self, nodes, vals):
         if not vals:
@@ -336,9 +386,14 @@ class Torus3dFrameDataModel(object):
 
         print self.agent.requestScene("nodes").total_range, "is total range for nodes"
         cval = self.agent.requestScene("nodes").cmap_range()
-        for node_id, val in zip(nodes, vals):
-            x, y, z = self.node_to_coord[node_id]
-            self.node_values[x, y, z] = [cval(val), 1]
+
+        # Ids outside of the torus are ignored
+        positions = self.node_map.positions(nodes)
+        present = positions >= 0
+        index = self.node_index[positions[present]]
+        node_values = self.node_values.reshape(-1, 2)
+        node_values[index, 0] = cval(np.asarray(vals, dtype = np.float64)[present])
+        node_values[index, 1] = 1
 
         self._notifyListeners()
 
@@ -356,26 +411,30 @@ class Torus3dFrameDataModel(object):
             raise ValueError("received %d values for %d links!"
                              % (num_values, num_links))
 
-        avg_link_values = np.zeros(self._shape + [3, 1])
-
         cval = self.agent.requestScene("links").cmap_range()
-        for link_id, val in zip(links, vals):
-            x, y, z, axis, direction = self.link_coord_to_index(
-                self.link_to_coord[link_id])
-
-            avg_link_values[x,y,z,axis] += val / 2.0
-            c = cval(val)
-            if direction > 0:
-                self.pos_link_values[x,y,z,axis] = [c, 1]
-            else:
-                self.neg_link_values[x,y,z,axis] = [c, 1]
+
+        # Ids outside of the torus are ignored
+        positions = self.link_map.positions(links)
+        present = positions >= 0
+        index = self.link_index[positions[present]]
+        direction = self.link_direction_index[positions[present]]
+        vals = np.asarray(vals, dtype = np.float64)[present]
+
+        avg_link_values = np.bincount(index, weights = vals / 2.0,
+            minlength = np.product(self.shape) * 3)
+
+        positive = direction > 0
+        pos_link_values = self.pos_link_values.reshape(-1, 2)
+        pos_link_values[index[positive], 0] = cval(vals[positive])
+        pos_link_values[index[positive], 1] = 1
+        neg_link_values = self.neg_link_values.reshape(-1, 2)
+        neg_link_values[index[~positive], 0] = cval(vals[~positive])
+        neg_link_values[index[~positive], 1] = 1
 
         print self.agent.requestScene("links").total_range, "is total range"
-        for index in np.ndindex(self.shape):
-            x, y, z = index
-            for axis in range(3):
-                color_val = cval(avg_link_values[x, y, z, axis])
-                self.avg_link_values[x, y, z, axis] = [color_val, 1]
+        self.avg_link_values[..., 0] = cval(avg_link_values).reshape(
+            self._shape + [3])
+        self.avg_link_values[..., 1] = 1
 
         self.changeLinkDirection(self.link_direction)
 
@@ -473,8 +532,8 @@ class Torus3dGLWidget(GLWidget):
         self.upperBound = 1
 
         # Display lists for nodes and links
-        self.cubeList = DisplayList(self.drawCubes)
-        self.linkList = DisplayList(self.drawLinks)
+        self.cubeList = self.createCubeList()
+        self.linkList = self.createLinkList()
         self.nodeBarList = DisplayList(self.drawNodeColorBar)
         self.linkBarList = DisplayList(self.drawLinkColorBar)
         self.nodeColorChangeSignal.connect(self.cubeList.update)
@@ -488,6 +547,18 @@ class Torus3dGLWidget(GLWidget):
         self.clearNodes()
         self.clearLinks()
 
+    def createCubeList(self):
+        """Returns the list drawing the nodes. Subclasses may override
+           this, by default the nodes are drawn by drawCubes.
+        """
+        return DisplayList(self.drawCubes)
+
+    def createLinkList(self):
+        """Returns the list drawing the links. Subclasses may override
+           this, by default the links are drawn by drawLinks.
+        """
+        return DisplayList(self.drawLinks)
+
     def setDataModel(self, dataModel):
         # unregister with any old model
         if self.dataModel:
@@ -543,11 +614,9 @@ class Torus3dGLWidget(GLWidget):
     def updateCubeColors(self):
         """Updates the node colors from the dataModel."""
         self.clearNodes()
-        for node in np.ndindex(*self.dataModel.shape):
-            self.node_colors[node] = self.map_node_color(
-                self.dataModel.node_values[node][0]) \
-                if (self.dataModel.node_values[node][1] \
-                > sys.float_info.epsilon) else self.default_node_color
+        node_values = self.dataModel.node_values
+        valid = node_values[..., 1] > sys.float_info.epsilon
+        self.node_colors[valid] = self.map_node_colors(node_values[valid, 0])
         self.nodeColorChangeSignal.emit()
 
     def updateLinkColors(self):
@@ -560,12 +629,9 @@ class Torus3dGLWidget(GLWidget):
         #            self.dataModel.avg_link_values[node][dim][0], link_range) \
         #            if (self.dataModel.avg_link_values[node][dim][1] \
         #            > sys.float_info.epsilon) else self.default_link_color
-        for node in np.ndindex(*self.dataModel.shape):
-            for dim in range(3):
-                self.link_colors[node][dim] = self.map_link_color(
-                    self.dataModel.link_values[node][dim][0]) \
-                    if (self.dataModel.link_values[node][dim][1] \
-                    > sys.float_info.epsilon) else self.default_link_color
+        link_values = self.dataModel.link_values[..., :3, :]
+        valid = link_values[..., 1] > sys.float_info.epsilon
+        self.link_colors[valid] = self.map_link_colors(link_values[valid, 0])
         self.linkColorChangeSignal.emit()
 
     def doLegend(self, bar_width = 20, bar_height = 160, bar_x = 20,
@@ -582,9 +648,7 @@ class Torus3dGLWidget(GLWidget):
     # TODO: Move these crazy defaults somewhere sane
     def drawNodeColorBar(self, x = 20, y = 90, w = 20, h = 120):
         """Draw the color bar for nodes."""
-        node_bar = []
-        for i in range(11):
-            node_bar.append(self.map_node_color(float(i)/10.0))
+        node_bar = self.map_node_colors(np.arange(11) / 10.0)
 
         self.textdraws.append(drawGLColorBar(node_bar, x, y, w, h, "N", self.height()))
 
@@ -598,9 +662,7 @@ class Torus3dGLWidget(GLWidget):
 
     def drawLinkColorBar(self, x = 50, y = 90, w = 20, h = 120):
         """Draw the color bar for links."""
-        link_bar = []
-        for i in range(11):
-            link_bar.append(self.map_link_color(float(i)/10.0))
+        link_bar = self.map_link_colors(np.arange(11) / 10.0)
 
         self.textdraws.append(drawGLColorBar(link_bar, x, y, w, h, "L", self.height()))
 
@@ -620,11 +682,31 @@ class Torus3dGLWidget(GLWidget):
         else:
             return self.link_cmap.getColor(val, preempt_range)
 
+    def map_node_colors(self, vals, preempt_range = 0):
+        """Turns an array of color values in [0,1] into an array of RGBA
+           colors. Used to map nodes.
+        """
+        return self.node_cmap.getColors(vals, preempt_range)
+
+    def map_link_colors(self, vals, preempt_range = 0):
+        """Turns an array of color values in [0,1] into an array of RGBA
+           colors. Used to map links.
+        """
+        return self.link_cmap.getColors(vals, preempt_range,
+            (self.lowerBound, self.upperBound), out_of_range_color = [1,1,1,0])
+
     def set_all_alphas(self, alpha):
         """Set all nodes and links to the same given alpha value."""
         self.node_colors[:,:,:,3] = alpha
         self.link_colors[:,:,:,:,3] = alpha
 
+    def highlightIndices(self, id_map, index, ids):
+        """Returns the flat block-array positions of the given ids,
+           ignoring ids that are not part of the torus.
+        """
+        positions = id_map.positions(ids)
+        return index[positions[positions >= 0]]
+
     @Slot(list, list)
     def updateHighlights(self, node_ids, link_ids):
         """Given a list of the node and link ids to be highlighted, changes
@@ -635,21 +717,18 @@ class Torus3dGLWidget(GLWidget):
         """
         if node_ids or link_ids: # Alpha based on appearance in these lists
             self.set_all_alphas(0.2)
-            for node in node_ids:
-                x, y, z = self.dataModel.node_to_coord[node]
-                self.node_colors[x, y, z, 3] = 1.0
-            for link in link_ids:
-                x, y, z, axis, direction = self.dataModel.link_coord_to_index(
-                    self.dataModel.link_to_coord[link])
-                self.link_colors[x,y,z,axis,3] = 1.0
+            self.node_colors.reshape(-1, 4)[
+                self.highlightIndices(self.dataModel.node_map,
+                    self.dataModel.node_index, node_ids), 3] = 1.0
+            if self.dataModel.has_links:
+                self.link_colors.reshape(-1, 4)[
+                    self.highlightIndices(self.dataModel.link_map,
+                        self.dataModel.link_index, link_ids), 3] = 1.0
         else: # Alpha based on data-present value in dataModel
-            for node in np.ndindex(*self.dataModel.shape):
-                self.node_colors[node][3] = 1.0 \
-                    if self.dataModel.node_values[node][1] > 0 else 0.2
-                vals = self.dataModel.link_values[node]
-                for dim in range(3):
-                    self.link_colors[node][dim][3] = 1.0 \
-                        if (vals[dim][1] > 0) else 0.2
+            self.node_colors[..., 3] = np.where(
+                self.dataModel.node_values[..., 1] > 0, 1.0, 0.2)
+            self.link_colors[..., 3] = np.where(
+                self.dataModel.link_values[..., :3, 1] > 0, 1.0, 0.2)
 
         self.updateDrawing()
 
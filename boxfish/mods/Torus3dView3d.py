@@ -1,5 +1,4 @@
 import numpy as np
-import operator
 
 from OpenGL.GL import *
 from OpenGL.GLU import *
@@ -84,6 +83,8 @@ class Torus3dView3d(Torus3dFrame):
 
 class GLTorus3dView(Torus3dGLWidget):
 
+    pick_enabled = True
+
     def __init__(self, parent, dataModel):
         super(GLTorus3dView, self).__init__(parent, dataModel)
 
@@ -95,12 +96,29 @@ class GLTorus3dView(Torus3dGLWidget):
         self.axisLength = 0.3
         self.axisList = DisplayList(self.drawAxis)
 
+        self.cubePickList = InstancedBufferList(self.cubeMeshes,
+            self.cubePickInstances)
+        self.cubePickIndex = BoxIndex(self.cubePickBoxes)
+        self.geometry_shape = None
+
 
         self.change_background_color(\
             self.parent.agent.module_scene.background_color)
 
 
 
+    def createCubeList(self):
+        """Nodes are drawn as instances of one cube mesh, which is only
+           rebuilt when the node size changes.
+        """
+        return InstancedBufferList(self.cubeMeshes, self.cubeInstances)
+
+    def createLinkList(self):
+        """Links are drawn as instances of one cylinder mesh per
+           dimension.
+        """
+        return InstancedBufferList(self.linkMeshes, self.linkInstances)
+
     def setDrawLinks(self, draw_links):
         self.draw_links = draw_links
         if not self.draw_links:
@@ -114,7 +132,9 @@ class GLTorus3dView(Torus3dGLWidget):
 
     def setNodeSize(self, node_size):
         self.box_size = node_size
-        self.cubeList.update()
+        self.cubeList.updateGeometry()
+        self.cubePickList.updateGeometry()
+        self.cubePickIndex.update()
         #self.updateGL()
         self.paintEvent(None)
 
@@ -123,9 +143,14 @@ class GLTorus3dView(Torus3dGLWidget):
             glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
             glGetError()
             self.orient_scene()
+            self.checkGeometry()
+            glPushMatrix()
+            self.centerView()
             self.cubeList()
             if self.draw_links:
+                glMaterialfv(GL_FRONT_AND_BACK,GL_DIFFUSE,[1.0, 1.0, 1.0, 1.0])
                 self.linkList()
+            glPopMatrix()
             self.doAxis()
             self.doLegend()
 
@@ -144,54 +169,54 @@ class GLTorus3dView(Torus3dGLWidget):
             (1,0,0),... etc. but they will appear centered around the global
             origin.
         """
-        spans = np.array(self.dataModel.shape, float)
-        half_spans = (spans - 1) / -2 * self.axis_directions
-        glTranslatef(*half_spans)
-
-    def centerNode(self, node):
-        """Translate view to coords where we want to render the node (x,y,z)"""
-        node = (np.array(node, int) + self.seam) % self.dataModel.shape
-        node *= self.axis_directions
-        glTranslatef(*node)
-
-    def drawCubes(self):
-        glPushMatrix()
-        self.centerView()
-
-        for node in np.ndindex(*self.dataModel.shape):
-            # draw a dataed cube with its center at (0,0,0)
-            glPushMatrix()
-            self.centerNode(node)
-            glColor4f(*self.node_colors[node])
-            notGlutSolidCube(self.box_size)
-            glPopMatrix()
-
-        # Get rid of the grid_span translation
-        glPopMatrix()
+        glTranslatef(*self.centerOffset())
 
+    def centerOffset(self):
+        """Returns the translation applied by centerView."""
+        spans = np.array(self.dataModel.shape, float)
+        return (spans - 1) / -2 * self.axis_directions
 
-    def drawLinks(self):
-        glMaterialfv(GL_FRONT_AND_BACK,GL_DIFFUSE,[1.0, 1.0, 1.0, 1.0])
-        glPushMatrix()
-        self.centerView()
+    def checkGeometry(self):
+        """Refetches the node and link instances if the torus has changed
+           shape since it was last drawn.
+        """
+        if self.geometry_shape != self.dataModel.shape:
+            self.geometry_shape = self.dataModel.shape
+            self.cubeList.update()
+            self.linkList.update()
+            self.cubePickIndex.update()
+
+    def nodeOffsets(self):
+        """Returns the translation of every node from centerView, in the
+           order of np.ndindex over the torus shape.
+        """
+        shape = self.dataModel.shape
+        nodes = np.indices(shape).reshape(len(shape), -1).T
+        return ((nodes + self.seam) % shape) * self.axis_directions
 
-        # origin-relative poly cylinder points for each dimension
-        poly_cylinders =[[(-1, 0, 0), (0, 0,  0), (1, 0, 0), (2, 0, 0)],
-                         [(0, -2, 0), (0, -1, 0), (0, 0, 0), (0, 1, 0)],
-                         [(0, 0, -2), (0, 0, -1), (0, 0, 0), (0, 0, 1)]]
+    def cubeMeshes(self):
+        """Returns the node cube mesh."""
+        return [solidCubeQuads(self.box_size)]
 
-        for node in np.ndindex(*self.dataModel.shape):
-            glPushMatrix()
-            self.centerNode(node)
-            colors = self.link_colors[node]
+    def cubeInstances(self):
+        """Returns the offset and color of the cube at every node."""
+        return [(self.nodeOffsets(), self.node_colors.reshape(-1, 4))]
 
-            # Draw links for each dim as poly cylinders
-            for dim in range(3):
-                glColor4f(*colors[dim])
-                notGlePolyCylinder(poly_cylinders[dim], None, self.link_radius)
+    def linkMeshes(self):
+        """Returns the link cylinder mesh for each dimension, each one
+           spanning from a node to its neighbor.
+        """
+        return [polyCylinderQuads(0, 1, 0, self.link_radius),
+                polyCylinderQuads(-1, 0, 1, self.link_radius),
+                polyCylinderQuads(-1, 0, 2, self.link_radius)]
 
-            glPopMatrix()
-        glPopMatrix()
+    def linkInstances(self):
+        """Returns the offset and color of the link cylinders starting at
+           every node, for each dimension.
+        """
+        offsets = self.nodeOffsets()
+        link_colors = self.link_colors.reshape(-1, 3, 4)
+        return [(offsets, link_colors[:, dim]) for dim in range(3)]
 
     def drawAxis(self):
         """This function does the actual drawing of the lines in the axis."""
@@ -224,101 +249,34 @@ class GLTorus3dView(Torus3dGLWidget):
         glPopMatrix()
         glViewport(0, 0, self.width(), self.height())
 
-    def mousePressEvent(self, event):
-        """We capture right clicking for picking here."""
-        super(GLTorus3dView, self).mousePressEvent(event)
-
-        if event.button() == Qt.RightButton:
-            self.parent.agent.selectionChanged([["nodes", self.doPick(event)]])
-
-    def doPick(self, event):
-        """Allow the user to pick nodes."""
-        # Adapted from Josh Levine's version in Boxfish 0.1
-        #steps:
-        #render the scene with labeled nodes
-        #find the color of the pixel @self.x, self.y
-        #map color back to id and return
-
-        #disable unneded
-        glDisable(GL_LIGHTING)
-        glDisable(GL_LIGHT0)
-        glDisable(GL_BLEND)
-
-        #set up the selection buffer
-        select_buf_size = reduce(operator.mul, self.dataModel.shape) + 10
-        glSelectBuffer(select_buf_size)
-
-        #switch to select mode
-        glRenderMode(GL_SELECT)
+    def cubePickInstances(self):
+        """Returns the offset and pick color of the cube at every node."""
+        offsets = self.nodeOffsets()
+        return [(offsets, pickColors(np.arange(len(offsets))))]
 
-        #initialize name stack
-        glInitNames()
-        glPushName(0)
-
-        #set up the pick matrix to draw a narrow view
-        viewport = glGetIntegerv(GL_VIEWPORT)
-        glMatrixMode(GL_PROJECTION)
-        glPushMatrix()
-        glLoadIdentity()
-        #this sets the size and location of the pick window
-        #changing the 1,1 will change sensitivity of the pick
-        gluPickMatrix(event.x(),(viewport[3]-event.y()),
-            1,1,viewport)
-        set_perspective(self.fov, self.width()/float(self.height()),
-            self.near_plane, self.far_plane)
-        #switch back to modelview and draw the scene
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
-        glTranslatef(*self.translation[:3])
-        glMultMatrixd(self.rotation)
-
-        #let's draw some red boxes, color is inconsequential
-        box_size = self.box_size
-        glColor3f(1.0, 0.0, 0.0)
-
-        # Redo the drawing
+    def pickDraw(self):
+        """Draws the node cubes in their pick colors."""
+        self.cubePickList.update()
         glPushMatrix()
         self.centerView()
-
-        # And draw all the cubes
-        # color index variable
-        for node in np.ndindex(*self.dataModel.shape):
-            glLoadName(self.dataModel.coord_to_node[node])
-            glPushMatrix()
-            self.centerNode(node)
-            notGlutSolidCube(box_size)
-            glPopMatrix()
-
-        glPopMatrix()
-
-        #pop projection matrix
-        glMatrixMode(GL_PROJECTION)
+        self.cubePickList()
         glPopMatrix()
-        glFlush()
-
-        #get the hit buffer
-        glMatrixMode(GL_MODELVIEW)
-        pick_buffer = glRenderMode(GL_RENDER)
-
-        #this code finds the nearest hit.  
-        #Otherwise, populate hitlist with hit[2] for all
-        #pick_buffer has a 3-tuple of info, [near, far, name]
-        nearest = 4294967295
-        hitlist = []
-        for hit in pick_buffer :
-            if hit[0] < nearest :
-              nearest = hit[0]
-              hitlist = [hit[2][0]]
-
-        #go back to normal rendering
-        glEnable(GL_LIGHTING)
-        glEnable(GL_LIGHT0)
-        glPolygonMode(GL_FRONT_AND_BACK,GL_FILL)
-        glEnable(GL_BLEND)
-        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
 
-        print hitlist
-        return hitlist
+    def cubePickBoxes(self):
+        """Returns the index and bounds of the cube at every node."""
+        centers = self.nodeOffsets() + self.centerOffset()
+        half_size = self.box_size / 2.0
+        return np.arange(len(centers)), centers - half_size, \
+            centers + half_size
+
+    def pickIndex(self):
+        self.checkGeometry()
+        return self.cubePickIndex
+
+    def pickSelect(self, indices):
+        """Selects the nodes picked with the mouse."""
+        self.parent.agent.selectionChanged([["nodes",
+            self.dataModel.nodesAt(indices)]])
 
 class Torus3dView3dRenderTab(QWidget):
 
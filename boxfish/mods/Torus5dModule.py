@@ -34,6 +34,7 @@ from OpenGL.GLUT import glutInit
 
 import TorusIcons
 from boxfish.ColorMaps import ColorMap, ColorMapWidget, drawGLColorBar
+from boxfish.util.IdMap import IdMap
 
 class Torus5dFrameDataModel(object):
     """This class is designed to hold data for a view of a 5d Torus.
@@ -59,6 +60,8 @@ class Torus5dFrameDataModel(object):
         self.shape = [0, 0, 0, 0, 0]
         self.agent = None
         self.link_direction = 0
+        self.node_map = IdMap([])
+        self.node_index = np.zeros(0, dtype = np.intp)
 
     def clearNodes(self):
         # The first is the actual value, the second is a flag
@@ -102,11 +105,32 @@ class Torus5dFrameDataModel(object):
         self.coord_to_link = coord_link
         self.shape = shape
 
+        # Flat positions in the block arrays of every node and link id,
+        # so that data updates are whole-array operations
+        self.node_map = IdMap(node_coord.keys())
+        node_coords = np.array([node_coord[node] for node in self.node_map.ids],
+            dtype = np.intp).reshape(-1, 5)
+        self.node_index = np.ravel_multi_index(node_coords.T, self.shape)
+
+        self.link_map = IdMap(link_coord.keys())
+        link_coords = np.array([link_coord[link]
+            for link in self.link_map.ids], dtype = np.intp).reshape(-1, 10)
+        a, b, c, d, e, axis, direction = self.link_coords_to_indices(link_coords)
+        self.link_index = np.ravel_multi_index((a, b, c, d, e, axis),
+            self.shape + (5, ))
+        self.link_direction_index = direction
+
     def _notifyListeners(self):
         #print 'NOTIFYING LISTENERS'
         for listener in self.listeners:
             listener()
 
+    def nodesAt(self, indices):
+        """Returns a list of the ids of the nodes at the given flat
+           positions in the block arrays.
+        """
+        return self.node_map.ids[np.in1d(self.node_index, indices)].tolist()
+
     def registerListener(self, listener):
         self.listeners.add(listener)
 
@@ -130,6 +154,24 @@ class Torus5dFrameDataModel(object):
             #return sa, sb, sc, sd, se, axis, -1
             return ta, tb, tc, td, te, axis, -1
 
+    def link_coords_to_indices(self, coords):
+        """Array version of link_coord_to_index. Given an N x 10 array of
+           link coordinates, returns arrays of the five coordinates, axis
+           and direction of each link.
+        """
+        start = coords[:, 0:5]
+        end = coords[:, 5:]
+
+        diff = end - start
+        axis = np.argmax(diff != 0, axis = 1)
+        axis_diff = diff[np.arange(len(coords)), axis]
+
+        # Positive links start at the source, negative ones at the target
+        positive = (axis_diff == 1) | (axis_diff < -1)
+        direction = np.where(positive, 1, -1)
+        a, b, c, d, e = np.where(positive[:, np.newaxis], start, end).T
+        return a, b, c, d, e, axis, direction
+
     def cmap_range(self, vals):
         """Use to normalize ranges for color maps.  Given a set of values,
         this will return a function that will normalize those values to
@@ -158,9 +200,14 @@ class Torus5dFrameDataModel(object):
 
         cval = self.agent.requestScene("nodes").cmap_range()
         cval = self.cmap_range(vals)
-        for node_id, val in zip(nodes, vals):
-            a, b, c, d, e = self.node_to_coord[node_id]
-            self.node_values[a, b, c, d, e] = [cval(val), 1]
+
+        # Ids outside of the torus are ignored
+        positions = self.node_map.positions(nodes)
+        present = positions >= 0
+        index = self.node_index[positions[present]]
+        node_values = self.node_values.reshape(-1, 2)
+        node_values[index, 0] = cval(np.asarray(vals, dtype = np.float64)[present])
+        node_values[index, 1] = 1
 
         self._notifyListeners()
 
@@ -178,33 +225,30 @@ class Torus5dFrameDataModel(object):
             raise ValueError("received %d values for %d links!"
                              % (num_values, num_links))
 
-        avg_link_values = np.zeros(self._shape + [5, 1])
-
         cval = self.agent.requestScene("links").cmap_range()
 
-        for link_id, val in zip(links, vals):
-            a, b, c, d, e, axis, direction = self.link_coord_to_index(
-                self.link_to_coord[link_id])
-
-            avg_link_values[a,b,c,d,e,axis] += val / 2.0
-            clamped_val = cval(val)
-            if direction > 0:
-                self.pos_link_values[a,b,c,d,e,axis] = [clamped_val, 1]
-            else:
-                self.neg_link_values[a,b,c,d,e,axis] = [clamped_val, 1]
+        # Ids outside of the torus are ignored
+        positions = self.link_map.positions(links)
+        present = positions >= 0
+        index = self.link_index[positions[present]]
+        direction = self.link_direction_index[positions[present]]
+        vals = np.asarray(vals, dtype = np.float64)[present]
 
         # 42 billion for 4096, 42 billion for 2048, 12 billion for 1024 MILC
-        for index in np.ndindex(self.shape):
-            a, b, c, d, e = index
-            for axis in range(5):
-                #if avg_link_values[a,b,c,d,e,axis] > 30000000000:
-                #    print avg_link_values[a,b,c,d,e,axis], a, b, c, d, e, axis
-                #if avg_link_values[a,b,c,d,e,axis] > 0:
-                    #   color_val = cval(math.log(avg_link_values[a,b,c,d,e,axis]))
-                #else:
-                    #   color_val = 0
-                color_val = cval(avg_link_values[a, b, c, d, e, axis])
-                self.avg_link_values[a, b, c, d, e, axis] = [color_val, 1]
+        avg_link_values = np.bincount(index, weights = vals / 2.0,
+            minlength = np.product(self.shape) * 5)
+
+        positive = direction > 0
+        pos_link_values = self.pos_link_values.reshape(-1, 2)
+        pos_link_values[index[positive], 0] = cval(vals[positive])
+        pos_link_values[index[positive], 1] = 1
+        neg_link_values = self.neg_link_values.reshape(-1, 2)
+        neg_link_values[index[~positive], 0] = cval(vals[~positive])
+        neg_link_values[index[~positive], 1] = 1
+
+        self.avg_link_values[..., 0] = cval(avg_link_values).reshape(
+            self._shape + [5])
+        self.avg_link_values[..., 1] = 1
 
         self.changeLinkDirection(self.link_direction)
 
@@ -425,10 +469,14 @@ class Torus5dAgent(GLAgent):
         """When the node-related request is updated, this re-grabs the
            values associated with the node-ids and signals the change.
         """
-        node_ids, values = self.requestOnDomain("nodes",
+        self.requestOnDomainAsync("nodes", self.nodeValuesReceived,
             domain_table = self.coords_table,
             row_aggregator = "mean", attribute_aggregator = "mean")
 
+    def nodeValuesReceived(self, node_ids, values):
+        """Stores the node values requested by updateNodeValues, updates the
+           color range, and signals the change.
+        """
         # Handle if color range has changed
         scene = self.requestScene("nodes")
         if values:
@@ -449,10 +497,14 @@ class Torus5dAgent(GLAgent):
         """When the link-related request is updated, this re-grabs the
            values associated with the link-ids and signals the change.
         """
-        link_ids, values = self.requestOnDomain("links",
+        self.requestOnDomainAsync("links", self.linkValuesReceived,
             domain_table = self.link_coords_table,
             row_aggregator = "mean", attribute_aggregator = "mean")
 
+    def linkValuesReceived(self, link_ids, values):
+        """Stores the link values requested by updateLinkValues, updates the
+           color range, and signals the change.
+        """
         scene = self.requestScene("links")
         if values:
             scene.local_max_range = (min(values), max(values))
@@ -622,11 +674,9 @@ class Torus5dGLWidget(GLWidget):
     def updateCubeColors(self):
         """Updates the node colors from the dataModel."""
         self.clearNodes()
-        for node in np.ndindex(*self.dataModel.shape):
-            self.node_colors[node] = self.map_node_color(
-                self.dataModel.node_values[node][0]) \
-                if (self.dataModel.node_values[node][1] \
-                > sys.float_info.epsilon) else self.default_node_color
+        node_values = self.dataModel.node_values
+        valid = node_values[..., 1] > sys.float_info.epsilon
+        self.node_colors[valid] = self.map_node_colors(node_values[valid, 0])
         #print 'UPDATING CUBE COLORS:  self.node_colors.shape = ' + str(self.node_colors.shape)
         #self.updateView(nodes = True, links = False)
         #TODO #self.nodeColorChangeSignal.emit()
@@ -634,13 +684,9 @@ class Torus5dGLWidget(GLWidget):
     def updateLinkColors(self):
         """Updates the link colors from the dataModel."""
         self.clearLinks()
-        for node in np.ndindex(*self.dataModel.shape):
-            for dim in range(5):
-                #print 'avg_link_values = ' + str(self.dataModel.avg_link_values[node][dim][0]) + ', link_range = ' + str(link_range)
-                self.link_colors[node][dim] = self.map_link_color(
-                    self.dataModel.link_values[node][dim][0]) \
-                    if (self.dataModel.link_values[node][dim][1] \
-                    > sys.float_info.epsilon) else self.default_link_color
+        link_values = self.dataModel.link_values
+        valid = link_values[..., 1] > sys.float_info.epsilon
+        self.link_colors[valid] = self.map_link_colors(link_values[valid, 0])
         #self.updateView(nodes = False, links = True)
         #TODO #self.linkColorChangeSignal.emit()
 
@@ -648,6 +694,13 @@ class Torus5dGLWidget(GLWidget):
         Qt.ShiftModifier = False # to fix the weird vertical translation bug
         super(Torus5dGLWidget, self).keyReleaseEvent(event)
 
+    def highlightIndices(self, id_map, index, ids):
+        """Returns the flat block-array positions of the given ids,
+           ignoring ids that are not part of the torus.
+        """
+        positions = id_map.positions(ids)
+        return index[positions[positions >= 0]]
+
     @Slot(list, list)
     def updateHighlights(self, node_ids, link_ids):
         """Given a list of the node and link ids to be highlighted, changes
@@ -659,23 +712,17 @@ class Torus5dGLWidget(GLWidget):
         if node_ids or link_ids: # Alpha based on appearance in these lists
             #print 'UPDATE HIGHLIGHTS: node_ids = ' + str(node_ids) + ', link_ids = ' + str(link_ids)
             self.set_all_alphas(0.2)
-            for node in node_ids:
-                a, b, c, d, e = self.dataModel.node_to_coord[node]
-                #print 'node:  a, b, c, d, e =',a,b,c,d,e
-                self.node_colors[a, b, c, d, e, 3] = 1.0
-            for link in link_ids:
-                a, b, c, d, e, axis, direction = self.dataModel.link_coord_to_index(
-                    self.dataModel.link_to_coord[link])
-                #print 'link:  a, b, c, d, e, axis =',a,b,c,d,e,axis
-                self.link_colors[a,b,c,d,e,axis,3] = 1.0
+            self.node_colors.reshape(-1, 4)[
+                self.highlightIndices(self.dataModel.node_map,
+                    self.dataModel.node_index, node_ids), 3] = 1.0
+            self.link_colors.reshape(-1, 4)[
+                self.highlightIndices(self.dataModel.link_map,
+                    self.dataModel.link_index, link_ids), 3] = 1.0
         else: # Alpha based on data-present value in dataModel
-            for node in np.ndindex(*self.dataModel.shape):
-                self.node_colors[node][3] = 1.0 \
-                    if self.dataModel.node_values[node][1] > 0 else 0.2
-                vals = self.dataModel.link_values[node]
-                for dim in range(5):
-                    self.link_colors[node][dim][3] = 1.0 \
-                        if (vals[dim][1] > 0) else 0.2
+            self.node_colors[..., 3] = np.where(
+                self.dataModel.node_values[..., 1] > 0, 1.0, 0.2)
+            self.link_colors[..., 3] = np.where(
+                self.dataModel.link_values[..., 1] > 0, 1.0, 0.2)
 
         self.updateDrawing()
         #self.updateView()
@@ -707,6 +754,22 @@ class Torus5dGLWidget(GLWidget):
         else:
             return self.link_cmap.getColor(val, preempt_range)
 
+    def map_node_colors(self, vals, preempt_range = 0):
+        """Turns an array of color values in [0,1] into an array of RGBA
+           colors. Used to map nodes.
+        """
+        return self.node_cmap.getColors(vals, preempt_range,
+            (self.lowerBoundNodes, self.upperBoundNodes),
+            out_of_range_alpha = self.outOfRangeOpacity)
+
+    def map_link_colors(self, vals, preempt_range = 0):
+        """Turns an array of color values in [0,1] into an array of RGBA
+           colors. Used to map links.
+        """
+        return self.link_cmap.getColors(vals, preempt_range,
+            (self.lowerBoundLinks, self.upperBoundLinks),
+            out_of_range_alpha = self.outOfRangeOpacity)
+
     def set_all_alphas(self, alpha):
         """Set all nodes and links to the same given alpha value."""
         self.node_colors[:,:,:,:,:,3] = alpha
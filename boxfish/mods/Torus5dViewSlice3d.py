@@ -1,6 +1,5 @@
 import math
 import numpy as np
-import operator
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from Torus5dModule import *
@@ -14,6 +13,7 @@ class Torus5dViewSlice3d(Torus5dGLWidget):
     Wrap-around links are drawn leaving the source node, disconnected from the
     destination node.
     '''
+    pick_enabled = True
 
     # ***************************    Initialize    *****************************
 
@@ -33,8 +33,13 @@ class Torus5dViewSlice3d(Torus5dGLWidget):
         self.widget2dLists.append(self.toolBarList)
 
         self.widget3dLists = []
-        self.nodeList = DisplayList(self.drawNodes)
-        self.linkList = DisplayList(self.drawLinks)
+        self.nodeList = InstancedBufferList(self.nodeMeshes,
+            self.nodeInstances)
+        self.linkList = InstancedBufferList(self.linkMeshes,
+            self.linkInstances)
+        self.nodePickList = InstancedBufferList(self.nodeMeshes,
+            self.nodePickInstances)
+        self.nodePickIndex = BoxIndex(self.nodePickBoxes)
         self.gridList = DisplayList(self.drawGrid)
         
         self.widget3dLists.append(self.nodeList)
@@ -111,7 +116,9 @@ class Torus5dViewSlice3d(Torus5dGLWidget):
             self.update()
 
     def updateDrawing(self, nodes = True, links = True, grid = True, axis = False, toolBar = True):
-        if nodes: self.nodeList.update()
+        if nodes:
+            self.nodeList.update()
+            self.nodePickIndex.update()
         if links: self.linkList.update()
         if toolBar:
             self.updateToolBarPos()
@@ -240,7 +247,7 @@ class Torus5dViewSlice3d(Torus5dGLWidget):
 
     def draw(self):
         for func in self.widget3dLists:
-            func() # display lists: call drawLinks(), drawNodes(), drawGrid()
+            func() # draw links, nodes and grid
 
         with overlays2D(self.width(), self.height(), self.bg_color):
             for func in self.widget2dLists:
@@ -322,53 +329,44 @@ class Torus5dViewSlice3d(Torus5dGLWidget):
         #print 'slice_span =',slice_span        
         """
 
-    def drawLinks(self):
-        glMaterialfv(GL_FRONT_AND_BACK,GL_DIFFUSE,[1.0, 1.0, 1.0, 1.0])
-        glPushMatrix()
-        self.centerView()
-        w, h, d = self.axis_map[self.axis][self.axis_index]
-
-        #print 'Main3D, drawLinks: current_planes = ' + str(self.current_planes)
-
-        # origin-relative poly cylinder points for each dimension
-        poly_cylinders =[[(-1, 0, 0), (0, 0,  0), (1, 0, 0), (2, 0, 0)],
-                         [(0, -2, 0), (0, -1, 0), (0, 0, 0), (0, 1, 0)],
-                         [(0, 0, -2), (0, 0, -1), (0, 0, 0), (0, 0, 1)]]
-
-        for node in np.ndindex(*self.shape):
-            if self.current_planes[d] == node[d] and self.current_planes[4] == node[4]:
-                glPushMatrix()
-                glTranslatef(*self.getNodePos3d(self.getSliceNode(node)))
-                colors = self.link_colors[node]
-
-                # Draw links for each dim as poly cylinders
-                polyDim = 0
-                for dim in w, h, self.axis:
-                    glColor4f(*colors[dim])
-                    notGlePolyCylinder(poly_cylinders[polyDim], None, self.link_width)
-                    polyDim += 1
-
-                glPopMatrix()
-        glPopMatrix()        
-
-    def drawNodes(self):
-        glPushMatrix()
-        self.centerView()
-        w, h, d = self.axis_map[self.axis][self.axis_index]
+    def getSliceNodes(self):
+        """Returns the flat indices of the nodes in the current planes and
+           their positions relative to the origin.
+        """
+        w, h, d = self.getSliceDims()
+        nodes = np.indices(self.shape).reshape(len(self.shape), -1).T
+        selected = np.nonzero((nodes[:, d] == self.current_planes[d])
+            & (nodes[:, 4] == self.current_planes[4]))[0]
+        slice_nodes = nodes[selected][:, [w, h, self.axis]]
+        positions = (slice_nodes + self.seam) % self.getSliceShape()
+        return selected, positions * self.axis_directions + self.centerOffset()
+
+    def linkMeshes(self):
+        """Returns the link cylinder meshes for the width, height and
+           depth dimensions.
+        """
+        return [polyCylinderQuads(0, 1, 0, self.link_width),
+                polyCylinderQuads(-1, 0, 1, self.link_width),
+                polyCylinderQuads(-1, 0, 2, self.link_width)]
 
-        #print 'Main3D, drawNodes: current_planes = ' + str(self.current_planes)
+    def linkInstances(self):
+        """Returns the positions and colors of the links starting at each
+           node in the current planes.
+        """
+        w, h, d = self.getSliceDims()
+        selected, positions = self.getSliceNodes()
+        link_colors = self.link_colors.reshape(-1, len(self.shape), 4)[selected]
+        return [(positions, link_colors[:, dim]) for dim in (w, h, self.axis)]
 
-        for node in np.ndindex(*self.shape):
-            if self.current_planes[d] == node[d] and self.current_planes[4] == node[4]:
-                # draw a dataed cube with its center at (0,0,0)
-                glPushMatrix()
-                glTranslatef(*self.getNodePos3d(self.getSliceNode(node)))
-                glColor4f(*self.node_colors[node])
-                notGlutSolidCube(self.node_size)
-                glPopMatrix()
+    def nodeMeshes(self):
+        return [solidCubeQuads(self.node_size)]
 
-        # Get rid of the grid_span translation
-        glPopMatrix()       
+    def nodeInstances(self):
+        """Returns the positions and colors of the nodes in the current
+           planes.
+        """
+        selected, positions = self.getSliceNodes()
+        return [(positions, self.node_colors.reshape(-1, 4)[selected])]
 
     def drawToolBar(self):
 
@@ -486,16 +484,23 @@ class Torus5dViewSlice3d(Torus5dGLWidget):
 
             glTranslatef(0., 0., -1.5*max(distx, disty))'''
 
-        half_spans = self.getSliceSpan(shape) / -2
-        half_spans[axis] = 0
-        half_spans *= self.axis_directions
-        glTranslatef(*half_spans)
+        glTranslatef(*self.centerOffset(shape, axis))
 
 
         #spans = np.array(shape, float)
         #half_spans = (spans - 1) / -2 * self.axis_directions
         #glTranslatef(*half_spans)
     
+    def centerOffset(self, shape = None, axis = 2):
+        """Returns the translation applied by centerView."""
+        if shape == None:
+            shape = self.getSliceShape()
+
+        half_spans = self.getSliceSpan(shape) / -2
+        half_spans[axis] = 0
+        half_spans *= self.axis_directions
+        return half_spans
+
     def drawAxisLines(self):
         """This function does the actual drawing of the lines in the axis."""
         # TODO:  Draw cones for arrows at the end of these lines
@@ -536,34 +541,19 @@ class Torus5dViewSlice3d(Torus5dGLWidget):
 
         #print 'drawColorBarSlider:  x =',x,', y =',y,', w =',w,', h =',h,', label =',label
 
-        bar = []
-        for i in range(num_pts+1):
-            if label == 'L':
-                val = float(i)/float(num_pts)
-                color = self.map_link_color(val)
-                if val < self.sliderOffsets[0] or val > self.sliderOffsets[1]:
-                    # segment is outside of the sliders, make semi-transparent
-                    color = list(color)
-                    color[3] = 0.2
-                    color = tuple(color)
-                else:
-                    color = list(color)
-                    color[3] = 1.
-                    color = tuple(color)
-                bar.append(color)
-            elif label == 'N':
-                val = float(i)/float(num_pts)
-                color = self.map_node_color(val)
-                if val < self.sliderOffsets[2] or val > self.sliderOffsets[3]:
-                    # segment is outside of the sliders, make semi-transparent
-                    color = list(color)
-                    color[3] = 0.2
-                    color = tuple(color)
-                else:
-                    color = list(color)
-                    color[3] = 1.
-                    color = tuple(color)
-                bar.append(color)
+        values = np.arange(num_pts + 1) / float(num_pts)
+        if label == 'L':
+            bar = self.map_link_colors(values)
+            low, high = self.sliderOffsets[0], self.sliderOffsets[1]
+        elif label == 'N':
+            bar = self.map_node_colors(values)
+            low, high = self.sliderOffsets[2], self.sliderOffsets[3]
+        else:
+            bar = np.zeros((0, 4), dtype = np.float32)
+            low, high = 0., 1.
+        # segments outside of the sliders are semi-transparent
+        bar[:, 3] = np.where((values[:len(bar)] < low)
+            | (values[:len(bar)] > high), 0.2, 1.)
 
         if self.bright_bg_color:
             border_color = (0.3, 0.3, 0.3, 1.)
@@ -849,6 +839,7 @@ class Torus5dViewSlice3d(Torus5dGLWidget):
         self.link_width += val
         if not inc: self.link_width = max(0.001,self.link_width)
         glLineWidth(self.link_width)
+        self.linkList.updateGeometry()
         self.updateDrawing()
 
     def changeNodeLinkBounds(self, lower, upper, links = True):
@@ -864,6 +855,9 @@ class Torus5dViewSlice3d(Torus5dGLWidget):
         self.node_size += val
         if not inc: self.node_size = max(0.025, self.node_size)
         #print 'self.node_size = ' + str(self.node_size)
+        self.nodeList.updateGeometry()
+        self.nodePickList.updateGeometry()
+        self.nodePickIndex.update()
         self.updateDrawing() 
 
     def changeSliderOffsets(self, num, x, y):
@@ -910,7 +904,7 @@ class Torus5dViewSlice3d(Torus5dGLWidget):
             super(Torus5dViewSlice3d, self).keyPressEvent(event)
 
     def mousePressEvent(self, event):
-        """We capture right clicking for picking here."""
+        """Right clicking for picking is handled by GLWidget."""
         super(Torus5dViewSlice3d, self).mousePressEvent(event)
 
         # Return if haven't dragged module onto the data tree yet to prevent
@@ -944,9 +938,6 @@ class Torus5dViewSlice3d(Torus5dGLWidget):
 
             #print 'x =',x,', y =',y,', iconHitBoxes =',self.iconHitBoxes
 
-        elif event.button() == Qt.RightButton:
-            self.parent.agent.selectionChanged([["nodes", self.selectionPick(event)]])
-
     def mouseReleaseEvent(self, event):
         """We keep track of whether a drag occurred with right-click."""
         super(Torus5dViewSlice3d, self).mouseReleaseEvent(event)
@@ -1039,110 +1030,30 @@ class Torus5dViewSlice3d(Torus5dGLWidget):
         self.sliderOffsets = [0 if i%2==0 else 1 for i in range(self.numIcons)]
         self.updateDrawing()
 
-    def selectionPick(self, event):
-        """Allow the user to pick nodes."""
-        # Adapted from Josh Levine's version in Boxfish 0.1
-        #steps:
-        #render the scene with labeled nodes
-        #find the color of the pixel @self.x, self.y
-        #map color back to id and return
-
-
-
-
-        #disable unneded
-        glDisable(GL_LIGHTING)
-        glDisable(GL_LIGHT0)
-        glDisable(GL_BLEND)
-
-        #set up the selection buffer
-        select_buf_size = reduce(operator.mul, self.shape) + 10
-        glSelectBuffer(select_buf_size)
-
-        #switch to select mode
-        glRenderMode(GL_SELECT)
-
-        #initialize name stack
-        glInitNames()
-        glPushName(0)
+    def nodePickInstances(self):
+        """Returns the positions and pick colors of the nodes in the
+           current planes.
+        """
+        selected, positions = self.getSliceNodes()
+        return [(positions, pickColors(selected))]
 
-        #set up the pick matrix to draw a narrow view
-        viewport = glGetIntegerv(GL_VIEWPORT)
-        glMatrixMode(GL_PROJECTION)
-        glPushMatrix()
-        glLoadIdentity()
-        #this sets the size and location of the pick window
-        #changing the 1,1 will change sensitivity of the pick
-        gluPickMatrix(event.x(),(viewport[3]-event.y()),
-            1,1,viewport)
-        set_perspective(self.fov, self.width()/float(self.height()),
-            self.near_plane, self.far_plane)
-        #switch back to modelview and draw the scene
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
-        glTranslatef(*self.translation[:3])
-        glMultMatrixd(self.rotation)
-
-        #let's draw some red boxes, color is inconsequential
-        box_size = self.node_size
-        glColor3f(1.0, 0.0, 0.0)
-
-        # Redo the drawing
-        glPushMatrix()
-        #self.resetView()  # need this?
-        self.centerView()
-
-        # And draw all the cubes
-        # color index variable
-        w, h, d = self.axis_map[self.axis][self.axis_index]
-
-        slice_shape = tuple(self.getSliceShape())
-
-        # TODO:  Figure out why the link_ids coming back after selecting a node
-        #   aren't correct (or aren't drawn correctly)
-
-        for node in np.ndindex(*self.shape):
-        # do this to reduce the number of nodes to index through,
-        # since we're only doing this for a specific plane
-        #for slice_node in np.ndindex(*slice_shape):
-            #node = self.getFullNode(slice_node)
-            #print 'loaddName = ' + str(self.dataModel.coord_to_node[node])
-            glLoadName(self.dataModel.coord_to_node[node])
-            glPushMatrix()
-            if node[d] == self.current_planes[d] and node[4] == self.current_planes[4]:
-                glTranslatef(*self.getNodePos3d(self.getSliceNode(node)))
-                notGlutSolidCube(box_size)
-            glPopMatrix()
+    def pickDraw(self):
+        """Draws the nodes in the current planes in their pick colors."""
+        self.nodePickList.update()
+        self.nodePickList()
 
-        glPopMatrix()
-
-        #pop projection matrix
-        glMatrixMode(GL_PROJECTION)
-        glPopMatrix()
-        glFlush()
-
-        #get the hit buffer
-        glMatrixMode(GL_MODELVIEW)
-        pick_buffer = glRenderMode(GL_RENDER)
- 
-        #this code finds the nearest hit.  
-        #Otherwise, populate hitlist with hit[2] for all
-        #pick_buffer has a 3-tuple of info, [near, far, name]
-        nearest = 4294967295
-        hitlist = []
-        for hit in pick_buffer :
-            #print 'SELECTION:  hit[0] = ' + str(hit[0]) + ', hit[1] = ' + str(hit[1]) + ', hit[2] = ' + str(hit[2])
-            if hit[0] < nearest :
-              nearest = hit[0]
-              hitlist = [hit[2][0]]
-
-        #go back to normal rendering
-        glEnable(GL_LIGHTING)
-        glEnable(GL_LIGHT0)
-        glPolygonMode(GL_FRONT_AND_BACK,GL_FILL)
-        glEnable(GL_BLEND)
-        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+    def nodePickBoxes(self):
+        """Returns the indices and bounds of the nodes in the current
+           planes.
+        """
+        selected, positions = self.getSliceNodes()
+        half_size = self.node_size / 2.0
+        return selected, positions - half_size, positions + half_size
 
-        #print hitlist
-        return hitlist
+    def pickIndex(self):
+        return self.nodePickIndex
 
+    def pickSelect(self, indices):
+        """Selects the nodes picked with the mouse."""
+        self.parent.agent.selectionChanged([["nodes",
+            self.dataModel.nodesAt(indices)]])
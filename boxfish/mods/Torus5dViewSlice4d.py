@@ -13,6 +13,7 @@ class Torus5dViewSlice4d(Torus5dGLWidget):
     dimension values are mapped to OpenGL-z space, and the fifth is a position
     offset in OpenGL-x space.  See UserGuide_5dTorus.pdf for more information.
     '''
+    pick_enabled = True
 
     # ***************************    Initialize    *****************************
 
@@ -62,7 +63,11 @@ class Torus5dViewSlice4d(Torus5dGLWidget):
 
         # display lists for nodes and links, get called from draw()
         self.widget3dLists = []
-        self.nodeList = DisplayList(self.drawNodes)
+        self.nodeList = InstancedBufferList(self.nodeMeshes,
+            self.nodeInstances)
+        self.nodePickList = InstancedBufferList(self.nodeMeshes,
+            self.nodePickInstances)
+        self.nodePickIndex = BoxIndex(self.nodePickBoxes)
         self.linkList = DisplayList(self.drawLinks)
         self.gridList = DisplayList(self.drawGrid)
         self.widget3dLists.append(self.nodeList)
@@ -126,7 +131,9 @@ class Torus5dViewSlice4d(Torus5dGLWidget):
         
     def updateDrawing(self, nodes = True, links = True, grid = True, toolBar = True):
         ''' Re-draws the scene without resetting the model view.'''
-        if nodes: self.nodeList.update()
+        if nodes:
+            self.nodeList.update()
+            self.nodePickIndex.update()
         if links: self.linkList.update()
         if grid: self.gridList.update()
         if toolBar: 
@@ -377,7 +384,7 @@ class Torus5dViewSlice4d(Torus5dGLWidget):
     
     def draw(self):
         for func in self.widget3dLists:
-            func() # display lists, call drawLinks(), drawNodes(), drawGrid()
+            func() # draw links, nodes and grid
 
         with overlays2D(self.width(), self.height(), self.bg_color):
             for func in self.widget2dLists:
@@ -439,42 +446,83 @@ class Torus5dViewSlice4d(Torus5dGLWidget):
     def drawLinks(self):
         self.drawLinks3d(self.link_colors)
 
-    def drawNodes(self):
+    def nodeMeshes(self):
+        return [solidCubeQuads(self.node_size)]
+
+    def getViewNodes(self):
+        """Returns the flat indices of the nodes in the view planes and
+           their positions relative to the origin.
+        """
         # to avoid error when dataModel is set but Torus5dModule.updateColors hasn't been called yet
         if self.node_colors.shape[0] == 0:
-            return
+            return np.zeros(0, dtype = np.intp), np.zeros((0, 3))
 
-        glPushMatrix()
-        slice_shape = self.getSliceShape()
-        self.centerView(slice_shape)
         w, h, d = self.getSliceDims()
-        higher_dims = [i for i in range(len(self.shape)) if i not in [w, h, d, self.axis]] 
-
-        for node5d in np.ndindex(*self.shape):
-            glPushMatrix()
-            #print '\tnodeID = ' + str(node5d)
-            #print '\td = ' + str(d)
-            #print '\tnode5d[d] = ' + str(node5d[d])
-            #print '\tself.view_planes[d] = ' + str(sorted(self.view_planes[d]))
-            if (node5d[d], node5d[4]) in self.view_planes[d]:
-                # center around the mapped noded
-                node3d = self.getNodePos3d(node5d, self.shape, self.axis)
-                #print 'node3d = ' + str(node3d)
-
-                #print '\tshape = ' + str(self.shape) + ', node_colors.shape = ' + str(self.node_colors.shape) + ', nodeID = ' + str(node5d)
-                #print '\tnodePosition = ' + str(node3d)
-                glTranslatef(*node3d)
-
-                # Draw cube with node color from the model
-                index = [node5d[i] for i in range(len(self.shape))]
-                #print '\tindex = ' + str(index)
-                glColor4f(*self.node_colors[index[0], index[1], index[2], index[3], index[4]])
-                notGlutSolidCube(self.node_size)
-
-            glPopMatrix()
-
-        # Get rid of the grid_span translation
-        glPopMatrix()        
+        nodes = np.indices(self.shape).reshape(len(self.shape), -1).T
+        in_view = np.zeros((self.shape[d], self.shape[4]), dtype = bool)
+        for plane, e_val in self.view_planes[d]:
+            in_view[plane, e_val] = True
+        selected = np.nonzero(in_view[nodes[:, d], nodes[:, 4]])[0]
+        # Coordinates in the slice with the e-dimension last, as taken by
+        # getSliceCoord
+        slice_nodes = nodes[selected][:, [w, h, self.axis, 4]]
+
+        # The xy position of a node only depends on its coordinate in that
+        # dimension, its depth and its e-value, so getSliceCoord is
+        # evaluated once per combination of those rather than per node
+        slice_shape = self.getSliceShape()
+        positions = np.zeros((len(selected), 3))
+        for dim in (0, 1):
+            coords = np.zeros((slice_shape[dim], slice_shape[2],
+                self.shape[4]))
+            for value, depth, e_val in np.ndindex(*coords.shape):
+                slice_node = [0, 0, depth, e_val]
+                slice_node[dim] = value
+                coords[value, depth, e_val] = self.getSliceCoord(
+                    slice_shape, 2, slice_node, dim)
+            positions[:, dim] = coords[slice_nodes[:, dim],
+                slice_nodes[:, 2], slice_nodes[:, 3]]
+        x_offsets = np.array([self.getNodeXOffset(e_val)
+            for e_val in range(self.shape[4])])
+        positions[:, 0] += x_offsets[slice_nodes[:, 3]]
+        positions[:, 2] = nodes[selected][:, d] * self.plane_spacing
+        positions *= self.axis_directions
+        positions += self.centerOffset(slice_shape)
+        return selected, positions
+
+    def nodeInstances(self):
+        """Returns the positions and colors of the nodes in the view
+           planes.
+        """
+        selected, positions = self.getViewNodes()
+        return [(positions, self.node_colors.reshape(-1, 4)[selected])]
+
+    def nodePickInstances(self):
+        """Returns the positions and pick colors of the nodes in the view
+           planes.
+        """
+        selected, positions = self.getViewNodes()
+        return [(positions, pickColors(selected))]
+
+    def pickDraw(self):
+        """Draws the nodes in the view planes in their pick colors."""
+        self.nodePickList.update()
+        self.nodePickList()
+
+    def nodePickBoxes(self):
+        """Returns the indices and bounds of the nodes in the view planes.
+        """
+        selected, positions = self.getViewNodes()
+        half_size = self.node_size / 2.0
+        return selected, positions - half_size, positions + half_size
+
+    def pickIndex(self):
+        return self.nodePickIndex
+
+    def pickSelect(self, indices):
+        """Selects the nodes picked with the mouse."""
+        self.parent.agent.selectionChanged([["nodes",
+            self.dataModel.nodesAt(indices)]])
 
     def drawToolBar(self):
 
@@ -586,6 +634,10 @@ class Torus5dViewSlice4d(Torus5dGLWidget):
     # ------------------------    Render, Level 3    ---------------------------
 
     def centerView(self, slice_shape, axis = 2, scale = 1):
+        glTranslatef(*self.centerOffset(slice_shape, axis, scale))
+
+    def centerOffset(self, slice_shape, axis = 2, scale = 1):
+        """Returns the translation applied by centerView."""
         half_spans = np.array(self.getSliceSpan(slice_shape), np.float) / -2
         half_spans[axis] = 0
         half_spans *= self.axis_directions
@@ -595,7 +647,7 @@ class Torus5dViewSlice4d(Torus5dGLWidget):
             half_spans[0] -= self.getNodeXOffset(1) # /2 factor already in getNodeXOffset
         else:
             half_spans[0] -= self.getNodeXOffset(1)/2.
-        glTranslatef(*half_spans)
+        return half_spans
 
     def drawButtonLinkToggle(self, x, y, w, h, line_color, fill_color):
 
@@ -1120,6 +1172,9 @@ class Torus5dViewSlice4d(Torus5dGLWidget):
         self.node_size += val
         if not inc: self.node_size = max(0.025, self.node_size)
         #print 'self.node_size = ' + str(self.node_size)
+        self.nodeList.updateGeometry()
+        self.nodePickList.updateGeometry()
+        self.nodePickIndex.update()
         self.updateDrawing() 
 
     def changePackFactor(self, links = False, nodes = False, inc = True):
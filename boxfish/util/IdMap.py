@@ -0,0 +1,45 @@
+import numpy as np
+
+class IdMap(object):
+    """This class maps the (possibly sparse) IDs of a subdomain onto
+       contiguous int32 positions and back, so that per-ID data can be
+       kept in flat numpy arrays indexed by position rather than in
+       dicts keyed by ID.
+
+       Positions follow the sorted order of the IDs.
+    """
+    def __init__(self, ids):
+        """Build the map from any sequence of IDs. Duplicates are
+           ignored.
+        """
+        self.ids = np.unique(np.asarray(ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, domain_id):
+        position = np.searchsorted(self.ids, domain_id)
+        return position < len(self.ids) and self.ids[position] == domain_id
+
+    def positions(self, ids, missing = -1):
+        """Return an int32 array of the positions of the given IDs. IDs
+           not in the map are given the position missing.
+        """
+        ids = np.asarray(ids)
+        if len(self.ids) == 0:
+            return np.zeros(ids.shape, dtype = np.int32) + missing
+        positions = np.searchsorted(self.ids, ids)
+        positions[positions >= len(self.ids)] = 0
+        positions = positions.astype(np.int32)
+        positions[self.ids[positions] != ids] = missing
+        return positions
+
+    def position(self, domain_id):
+        """Return the position of a single ID or -1 if it is not in the
+           map.
+        """
+        return int(self.positions([domain_id])[0])
+
+    def lookup(self, positions):
+        """Return the IDs at the given positions."""
+        return self.ids[np.asarray(positions)]
@@ -0,0 +1,102 @@
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+
+def approximateSize(value):
+    """Returns an estimate of the number of bytes held by value, following
+       the contents of numpy arrays, lists, tuples and dicts.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        size = sys.getsizeof(value)
+        if len(value) and not isinstance(value[0], (list, tuple, dict,
+            np.ndarray)):
+            # Assume uniform scalars to avoid visiting every one
+            return size + len(value) * sys.getsizeof(value[0])
+        return size + sum(approximateSize(x) for x in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(approximateSize(k)
+            + approximateSize(v) for k, v in value.iteritems())
+    return sys.getsizeof(value)
+
+
+class LRUCache(object):
+    """This class implements a bounded mapping which discards the least
+       recently used entries once it holds more than max_entries of them
+       or, if max_bytes is given, once their approximate size exceeds
+       max_bytes. It may be shared between threads.
+    """
+    def __init__(self, max_entries = 32, max_bytes = None,
+        sizeof = approximateSize):
+        """Construct an empty cache holding at most max_entries values
+           and, unless max_bytes is None, at most max_bytes bytes as
+           measured by the sizeof function.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.num_bytes = 0
+        self._data = OrderedDict()
+        self._sizes = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default = None):
+        """Return the value cached under key, marking it as the most
+           recently used, or default if there is no such value.
+        """
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data.pop(key)
+            self._data[key] = value
+            return value
+
+    def put(self, key, value):
+        """Cache value under key, discarding the least recently used
+           entries if the cache is full.
+        """
+        size = 0
+        if self.max_bytes is not None:
+            size = self.sizeof(value)
+
+        with self._lock:
+            if key in self._data:
+                del self._data[key]
+                self.num_bytes -= self._sizes.pop(key)
+            self._data[key] = value
+            self._sizes[key] = size
+            self.num_bytes += size
+            while len(self._data) > self.max_entries or (len(self._data) > 1
+                and self.max_bytes is not None
+                and self.num_bytes > self.max_bytes):
+                old_key, old_value = self._data.popitem(last = False)
+                self.num_bytes -= self._sizes.pop(old_key)
+
+    def items(self):
+        """Return a list of the cached (key, value) pairs from the least
+           to the most recently used, without marking them as used.
+        """
+        with self._lock:
+            return self._data.items()
+
+    def purge(self, predicate):
+        """Discard the cached values whose keys satisfy predicate."""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+                self.num_bytes -= self._sizes.pop(key)
+
+    def clear(self):
+        """Discard all cached values."""
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.num_bytes = 0
@@ -1 +1,3 @@
 import IndexCache
+import LRUCache
+import IdMap